@@ -0,0 +1,142 @@
+"""Data loading benchmark: measure the throughput of create_dataset(opt) without any model.
+
+For every combination of the --bench_* settings, it creates the dataset, iterates over --bench_batches batches and reports
+    - images/sec after the first batch,
+    - the time to the first batch (dataset creation and worker start-up included),
+    - the mean time per data point spent in each loader worker (decoding and preprocessing),
+and writes all the results to a JSON file, so that loader changes can be compared.
+
+Example:
+    Compare worker counts and dataset modes:
+        python benchmark_data.py --dataroot ./datasets/maps --bench_dataset_modes unaligned,packed --bench_num_threads 0,4,8
+    Compare preprocessing backends:
+        python benchmark_data.py --dataroot ./datasets/maps --augment_backend tensor --bench_batch_sizes 1,8
+
+See options/base_options.py and options/benchmark_options.py for more options.
+"""
+import os
+import json
+import time
+import itertools
+from copy import deepcopy
+import torch
+from options.benchmark_options import BenchmarkOptions
+from data import create_dataset
+
+
+def timed(data, start_time):
+    """Add the time since <start_time> and the id of the current loader worker to the data point <data>."""
+    worker_info = torch.utils.data.get_worker_info()
+    data['load_time'] = time.perf_counter() - start_time
+    data['worker_id'] = worker_info.id if worker_info is not None else -1
+    return data
+
+
+def timed_getitem(self, index):
+    """<__getitem__> of the timed map-style datasets."""
+    start_time = time.perf_counter()
+    return timed(super(type(self), self).__getitem__(index), start_time)
+
+
+def timed_iter(self):
+    """<__iter__> of the timed iterable datasets: the time between two data points."""
+    start_time = time.perf_counter()
+    for data in super(type(self), self).__iter__():
+        yield timed(data, start_time)
+        start_time = time.perf_counter()
+
+
+def timed_reduce(self):
+    """Pickle a timed dataset as its original class plus <add_timing>.
+
+    The timed class only exists in this process, but the workers of the spawn and forkserver start methods unpickle the dataset.
+    """
+    return restore_timing, (type(self).__base__, self.__dict__)
+
+
+def restore_timing(dataset_class, state):
+    """Unpickle a dataset that <add_timing> switched to a timed class."""
+    dataset = dataset_class.__new__(dataset_class)
+    dataset.__dict__.update(state)
+    add_timing(dataset)
+    return dataset
+
+
+def add_timing(dataset):
+    """Make <dataset> record how long every data point takes to load, and in which worker.
+
+    The dataset switches to a subclass in place, before the DataLoader starts its workers.
+    The recorded times are added to every data point as 'load_time' and 'worker_id' (-1 for the main process).
+    The methods of the subclass are module-level functions, so that the dataset stays picklable (see <timed_reduce>).
+    """
+    dataset_class = type(dataset)
+    methods = {'__iter__': timed_iter} if isinstance(dataset, torch.utils.data.IterableDataset) else {'__getitem__': timed_getitem}
+    methods['__reduce__'] = timed_reduce
+    dataset.__class__ = type('Timed' + dataset_class.__name__, (dataset_class,), methods)
+
+
+def run_benchmark(opt):
+    """Iterate over opt.bench_batches batches of create_dataset(opt) and return the measurements."""
+    start_time = time.perf_counter()
+    dataset = create_dataset(opt)
+    add_timing(dataset.dataset)
+    setup_time = time.perf_counter() - start_time
+
+    worker_times = {}
+    num_images, first_batch_time = 0, None
+    for i, data in enumerate(dataset):
+        for worker_id, load_time in zip(data.pop('worker_id').tolist(), data.pop('load_time').tolist()):
+            worker_times.setdefault(worker_id, []).append(load_time)
+        if first_batch_time is None:  # the throughput is measured without the start-up
+            first_batch_time = time.perf_counter()
+            time_to_first_batch = first_batch_time - start_time
+        else:
+            num_images += len(data['A'])
+        if i >= opt.bench_batches:
+            break
+    if first_batch_time is None:  # the dataset yielded no batches
+        print('no batches were loaded; the throughput is reported as 0')
+        elapsed, time_to_first_batch = 0, None
+    else:
+        elapsed = time.perf_counter() - first_batch_time
+
+    return {
+        'setup_time': setup_time,
+        'time_to_first_batch': time_to_first_batch,
+        'images_per_sec': num_images / elapsed if elapsed > 0 else 0.0,
+        'num_images': num_images,
+        'worker_load_time': {str(worker_id): {'num_images': len(times), 'mean': sum(times) / len(times), 'total': sum(times)}
+                             for worker_id, times in sorted(worker_times.items())},
+    }
+
+
+def parse_list(values, default, type=str):
+    return [type(v) for v in values.split(',') if v] or [default]
+
+
+if __name__ == '__main__':
+    opt = BenchmarkOptions().parse()   # get benchmark options
+    grid = {
+        'dataset_mode': parse_list(opt.bench_dataset_modes, opt.dataset_mode),
+        'preprocess': parse_list(opt.bench_preprocess, opt.preprocess),
+        'num_threads': parse_list(opt.bench_num_threads, opt.num_threads, int),
+        'batch_size': parse_list(opt.bench_batch_sizes, opt.batch_size, int),
+    }
+    results = []
+    for values in itertools.product(*grid.values()):
+        setting = dict(zip(grid.keys(), values))
+        bench_opt = deepcopy(opt)
+        for k, v in setting.items():
+            setattr(bench_opt, k, v)
+        print('benchmarking %s' % setting)
+        result = run_benchmark(bench_opt)
+        worker_means = ', '.join('%s: %.2f ms' % (k, v['mean'] * 1000) for k, v in result['worker_load_time'].items())
+        first_batch = '%.2f sec' % result['time_to_first_batch'] if result['time_to_first_batch'] is not None else 'never'
+        print('%.1f images/sec, first batch after %s, load time per image [%s]' % (result['images_per_sec'], first_batch, worker_means))
+        results.append({'setting': setting, **result})
+
+    output = opt.bench_output or os.path.join(opt.checkpoints_dir, opt.name, 'data_benchmark.json')
+    common = {k: v for k, v in vars(opt).items() if k not in grid and not k.startswith('bench_')}
+    with open(output, 'w') as f:
+        json.dump({'options': common, 'results': results}, f, indent=2, default=str)
+    print('saved the results to %s' % output)
@@ -13,6 +13,8 @@ See our template dataset class 'template_dataset.py' for more details.
 import importlib
 import torch.utils.data
 from data.base_dataset import BaseDataset
+from data.batch_transform import BatchTransform, collate_images
+from data.samplers import BucketBatchSampler, UnalignedPairSampler
 
 
 def find_dataset_using_name(dataset_name):
@@ -72,15 +74,40 @@ class CustomDatasetDataLoader():
         dataset_class = find_dataset_using_name(opt.dataset_mode)
         self.dataset = dataset_class(opt)
         print("dataset [%s] was created" % type(self.dataset).__name__)
+        self.batch_transform = None
+        collate_fn = None  # the default collate function
+        if opt.augment_backend == 'tensor':
+            self.batch_transform = BatchTransform(opt, aligned=self.dataset.aligned)
+            collate_fn = collate_images
+        if opt.bucket_by_shape and opt.pair_sampler:
+            raise ValueError('--bucket_by_shape and --pair_sampler cannot be combined: both choose the data points of every batch')
+        if opt.bucket_by_shape:  # only batch images that have the same shape after preprocessing
+            batch_sampler = BucketBatchSampler(self.dataset.get_shape_keys(), opt.batch_size, shuffle=not opt.serial_batches)
+            sampler_kwargs = {'batch_sampler': batch_sampler}
+        elif opt.pair_sampler:  # draw the (A, B) pairs of every epoch up front
+            A_size, B_size = self.dataset.get_domain_sizes()
+            sampler = UnalignedPairSampler(A_size, B_size, shuffle=not opt.serial_batches, seed=opt.sampler_seed)
+            sampler_kwargs = {'batch_size': opt.batch_size, 'sampler': sampler}
+        elif isinstance(self.dataset, torch.utils.data.IterableDataset):  # the dataset shuffles and shards its streams itself
+            sampler_kwargs = {'batch_size': opt.batch_size}
+        else:
+            sampler_kwargs = {'batch_size': opt.batch_size, 'shuffle': not opt.serial_batches}
         self.dataloader = torch.utils.data.DataLoader(
             self.dataset,
-            batch_size=opt.batch_size,
-            shuffle=not opt.serial_batches,
-            num_workers=int(opt.num_threads))
+            num_workers=int(opt.num_threads),
+            collate_fn=collate_fn,
+            pin_memory=opt.uint8_transfer and len(opt.gpu_ids) > 0,
+            **sampler_kwargs)
 
     def load_data(self):
         return self
 
+    def set_epoch(self, epoch):
+        """Tell the sampler which epoch comes next, if it depends on it (see <UnalignedPairSampler>)."""
+        sampler = self.dataloader.sampler
+        if hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(epoch)
+
     def __len__(self):
         """Return the number of data in the dataset"""
         return min(len(self.dataset), self.opt.max_dataset_size)
@@ -90,4 +117,6 @@ class CustomDatasetDataLoader():
         for i, data in enumerate(self.dataloader):
             if i * self.opt.batch_size >= self.opt.max_dataset_size:
                 break
+            if self.batch_transform is not None:
+                data = self.batch_transform(data)
             yield data
@@ -1,7 +1,7 @@
 import os
 from data.base_dataset import BaseDataset, get_params, get_transform
-from data.image_folder import make_dataset
-from PIL import Image
+from data.image_cache import create_resize_cache
+from data.samplers import get_output_size
 
 
 class AlignedDataset(BaseDataset):
@@ -19,10 +19,12 @@ class AlignedDataset(BaseDataset):
         """
         BaseDataset.__init__(self, opt)
         self.dir_AB = os.path.join(opt.dataroot, opt.phase)  # get the image directory
-        self.AB_paths = sorted(make_dataset(self.dir_AB, opt.max_dataset_size))  # get image paths
+        self.aligned = True
+        self.AB_paths = self.find_image_paths(self.dir_AB)  # get image paths
         assert(self.opt.load_size >= self.opt.crop_size)   # crop_size should be smaller than the size of loaded image
         self.input_nc = self.opt.output_nc if self.opt.direction == 'BtoA' else self.opt.input_nc
         self.output_nc = self.opt.input_nc if self.opt.direction == 'BtoA' else self.opt.output_nc
+        self.resize_cache = create_resize_cache(opt)
 
     def __getitem__(self, index):
         """Return a data point and its metadata information.
@@ -38,23 +40,43 @@ class AlignedDataset(BaseDataset):
         """
         # read a image given a random integer index
         AB_path = self.AB_paths[index]
-        AB = Image.open(AB_path).convert('RGB')
-        # split AB image into A and B
-        w, h = AB.size
-        w2 = int(w / 2)
-        A = AB.crop((0, 0, w2, h))
-        B = AB.crop((w2, 0, w, h))
+        if self.resize_cache is not None:  # both halves are already resized to load_size
+            halves = []  # on a cache miss, the AB image is decoded once for both halves
+
+            def load_half(path, i):
+                if not halves:
+                    halves.extend(self.split_AB(path))
+                return halves[i]
+            A = self.resize_cache.get(AB_path, self.input_nc == 1, loader=lambda path: load_half(path, 0), tag='A')
+            B = self.resize_cache.get(AB_path, self.output_nc == 1, loader=lambda path: load_half(path, 1), tag='B')
+        else:
+            A, B = self.split_AB(AB_path)
 
         # apply the same transform to both A and B
+        resized = self.resize_cache is not None
         transform_params = get_params(self.opt, A.size)
-        A_transform = get_transform(self.opt, transform_params, grayscale=(self.input_nc == 1))
-        B_transform = get_transform(self.opt, transform_params, grayscale=(self.output_nc == 1))
+        A_transform = get_transform(self.opt, transform_params, grayscale=(self.input_nc == 1), resized=resized)
+        B_transform = get_transform(self.opt, transform_params, grayscale=(self.output_nc == 1), resized=resized)
 
         A = A_transform(A)
         B = B_transform(B)
 
         return {'A': A, 'B': B, 'A_paths': AB_path, 'B_paths': AB_path}
 
+    def split_AB(self, AB_path):
+        """Load an AB image and split it into the A and B halves."""
+        AB = self.load_image(AB_path, width_factor=2, allow_tensor=False)
+        w, h = AB.size
+        w2 = int(w / 2)
+        A = AB.crop((0, 0, w2, h))
+        B = AB.crop((w2, 0, w, h))
+        return A, B
+
+    def get_shape_keys(self):
+        """Return the output shape of every data point; A and B are the halves of one image."""
+        sizes = self.find_image_sizes(self.dir_AB, self.AB_paths)
+        return [get_output_size(self.opt, int(w / 2), h) for w, h in sizes]
+
     def __len__(self):
         """Return the total number of images in the dataset."""
         return len(self.AB_paths)
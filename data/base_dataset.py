@@ -4,9 +4,12 @@ It also includes common transformation functions (e.g., get_transform, __scale_w
 """
 import random
 import numpy as np
+import torch
 import torch.utils.data as data
 from PIL import Image
 import torchvision.transforms as transforms
+from data.image_folder import make_dataset, get_image_sizes
+from data.image_decode import load_image
 from abc import ABC, abstractmethod
 
 
@@ -28,6 +31,7 @@ class BaseDataset(data.Dataset, ABC):
         """
         self.opt = opt
         self.root = opt.dataroot
+        self.aligned = False  # set to True if A and B of a data point are paired and share crop/flip parameters
 
     @staticmethod
     def modify_commandline_options(parser, is_train):
@@ -42,6 +46,48 @@ class BaseDataset(data.Dataset, ABC):
         """
         return parser
 
+    def find_image_paths(self, dir):
+        """Return the sorted image paths under <dir>, at most opt.max_dataset_size of them.
+
+        With '--use_manifest' or '--verify_images', the directory listing comes from a persisted manifest
+        (see <ImageManifest> in data/image_folder.py) instead of a full walk of the directory tree.
+        """
+        opt = self.opt
+        return sorted(make_dataset(dir, opt.max_dataset_size, use_manifest=opt.use_manifest, manifest_dir=opt.manifest_dir,
+                                   verify=opt.verify_images, num_workers=max(1, opt.num_threads)))
+
+    def find_image_sizes(self, dir, paths):
+        """Return the (width, height) of every image in <paths> found by <find_image_paths> under <dir>."""
+        opt = self.opt
+        return get_image_sizes(dir, paths, use_manifest=opt.use_manifest or opt.verify_images, manifest_dir=opt.manifest_dir,
+                               num_workers=max(1, opt.num_threads))
+
+    def get_shape_keys(self):
+        """Return the output shape of every data point, for '--bucket_by_shape' (see data/samplers.py).
+
+        Data points with the same key must produce images of the same shapes after preprocessing.
+        """
+        raise NotImplementedError('%s does not support --bucket_by_shape' % type(self).__name__)
+
+    def get_domain_sizes(self):
+        """Return the number of A and B images of an unaligned dataset, for '--pair_sampler' (see data/samplers.py).
+
+        Datasets that support it accept (index_A, index_B) tuples in <__getitem__>.
+        """
+        raise NotImplementedError('%s does not support --pair_sampler' % type(self).__name__)
+
+    def load_image(self, path, width_factor=1, allow_tensor=True):
+        """Decode the image at <path> with '--decode_backend' (see data/image_decode.py).
+
+        Parameters:
+            path (str)          -- the image file
+            width_factor (int)  -- how many images are stored side by side in the file (2 for aligned A|B images)
+            allow_tensor (bool) -- if a uint8 CxHxW tensor may be returned instead of a PIL image;
+                                   only done with '--augment_backend tensor', whose transforms accept both
+        """
+        allow_tensor = allow_tensor and self.opt.augment_backend == 'tensor'
+        return load_image(path, self.opt, width_factor, allow_tensor)
+
     @abstractmethod
     def __len__(self):
         """Return the total number of images in the dataset."""
@@ -78,7 +124,11 @@ def get_params(opt, size):
     return {'crop_pos': (x, y), 'flip': flip}
 
 
-def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, convert=True):
+def get_resize_transform(opt, grayscale=False, method=Image.BICUBIC):
+    """Return the deterministic part of <get_transform>: grayscale conversion and resizing to load_size.
+
+    Its output does not change between epochs, so it can be cached (see data/image_cache.py).
+    """
     transform_list = []
     if grayscale:
         transform_list.append(transforms.Grayscale(1))
@@ -87,6 +137,22 @@ def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, conve
         transform_list.append(transforms.Resize(osize, method))
     elif 'scale_width' in opt.preprocess:
         transform_list.append(transforms.Lambda(lambda img: __scale_width(img, opt.load_size, opt.crop_size, method)))
+    return transform_list
+
+
+def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, convert=True, resized=False):
+    """Return the preprocessing pipeline given by opt.preprocess.
+
+    If <resized> is True, the images are expected to have gone through <get_resize_transform> already,
+    and only the random crop, flip and tensor conversion are applied.
+    """
+    if convert and opt.augment_backend == 'tensor':  # resize, crop, flip and normalization run batched after collation; see data/batch_transform.py
+        transform_list = [transforms.Grayscale(1)] if grayscale else []
+        return transforms.Compose(transform_list + [transforms.Lambda(to_uint8_tensor)])
+
+    transform_list = []
+    if not resized:
+        transform_list += get_resize_transform(opt, grayscale, method)
 
     if 'crop' in opt.preprocess:
         if params is None:
@@ -103,7 +169,9 @@ def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, conve
         elif params['flip']:
             transform_list.append(transforms.Lambda(lambda img: __flip(img, params['flip'])))
 
-    if convert:
+    if convert and opt.uint8_transfer:  # the model normalizes the images on its device; see <BaseModel.prepare_image>
+        transform_list += [transforms.Lambda(to_uint8_tensor)]
+    elif convert:
         transform_list += [transforms.ToTensor()]
         if grayscale:
             transform_list += [transforms.Normalize((0.5,), (0.5,))]
@@ -112,6 +180,16 @@ def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, conve
     return transforms.Compose(transform_list)
 
 
+def to_uint8_tensor(img):
+    """Convert a PIL image into a uint8 CxHxW tensor without rescaling the values."""
+    if isinstance(img, torch.Tensor):  # already decoded into a tensor; see data/image_decode.py
+        return img
+    array = np.array(img, dtype=np.uint8)
+    if array.ndim == 2:
+        array = array[:, :, None]
+    return torch.from_numpy(array).permute(2, 0, 1).contiguous()
+
+
 def __make_power_2(img, base, method=Image.BICUBIC):
     ow, oh = img.size
     h = int(round(oh / base) * base)
@@ -0,0 +1,136 @@
+"""Batched, tensor-side preprocessing ('--augment_backend tensor').
+
+By default, <get_transform> builds a PIL pipeline (resize, crop, flip, ToTensor, Normalize) that runs image by image
+in the DataLoader workers. With '--augment_backend tensor', the workers only decode the images into uint8 tensors;
+<BatchTransform> then resizes, crops, flips and normalizes the whole collated batch with vectorized tensor ops.
+It supports the same '--preprocess' modes, and A and B of aligned datasets share their crop and flip parameters.
+"""
+import torch
+import torch.nn.functional as F
+try:
+    from torch.utils.data import default_collate
+except ImportError:  # torch < 1.11
+    from torch.utils.data._utils.collate import default_collate
+
+
+def collate_images(batch):
+    """Collate a list of data points like the default DataLoader, but keep differently-sized images in a list."""
+    collated = {}
+    for key, elem in batch[0].items():
+        values = [d[key] for d in batch]
+        if isinstance(elem, torch.Tensor) and any(v.shape != elem.shape for v in values):
+            collated[key] = values
+        else:
+            collated[key] = default_collate(values)
+    return collated
+
+
+def get_resize_size(opt, w, h):
+    """Return the (height, width) that opt.preprocess resizes a w x h image to; mirrors <get_transform>."""
+    if 'resize' in opt.preprocess:
+        return opt.load_size, opt.load_size
+    if 'scale_width' in opt.preprocess:
+        if w == opt.load_size and h >= opt.crop_size:
+            return h, w
+        return int(max(opt.load_size * h / w, opt.crop_size)), opt.load_size
+    if opt.preprocess == 'none':  # make the size a multiple of 4
+        return int(round(h / 4) * 4), int(round(w / 4) * 4)
+    return h, w
+
+
+class BatchTransform():
+    """Apply the preprocessing of <get_transform> to collated batches of uint8 images."""
+
+    def __init__(self, opt, aligned=False):
+        """Initialize the batch transform.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+            aligned (bool)     -- if A and B of a data point share the random crop and flip parameters
+        """
+        self.opt = opt
+        self.aligned = aligned
+        self.interpolate_kwargs = {'mode': 'bicubic', 'align_corners': False}
+        if 'antialias' in F.interpolate.__code__.co_varnames:  # torch >= 1.11; closer to PIL when downscaling
+            self.interpolate_kwargs['antialias'] = True
+
+    def __call__(self, data):
+        """Transform the uint8 images stored under 'A' and 'B' in a collated batch; other entries are left as they are."""
+        keys = [k for k in ('A', 'B') if k in data and self.is_uint8(data[k])]
+        if not keys:
+            return data
+        batch_size = len(data[keys[0]])
+        params = self.get_params(batch_size)
+        for key in keys:
+            data[key] = self.transform(data[key], params)
+            if not self.aligned:  # draw new crop and flip parameters for the other domain
+                params = self.get_params(batch_size)
+        return data
+
+    @staticmethod
+    def is_uint8(images):
+        if isinstance(images, list):
+            return len(images) > 0 and images[0].dtype == torch.uint8
+        return isinstance(images, torch.Tensor) and images.dtype == torch.uint8
+
+    def get_params(self, batch_size):
+        """Draw the random crop position (as a fraction of the free range) and the flip of every image."""
+        return {'crop': torch.rand(batch_size, 2), 'flip': torch.rand(batch_size) > 0.5}
+
+    def transform(self, images, params):
+        """Resize, crop, flip and normalize a batch of uint8 images.
+
+        Parameters:
+            images -- a uint8 tensor of shape [N, C, H, W], or a list of N uint8 [C, H, W] tensors of different sizes
+            params -- the random parameters drawn by <get_params>
+
+        Returns a float tensor of shape [N, C, H', W'] in [-1, 1] (uint8 in [0, 255] with '--uint8_transfer').
+        """
+        if isinstance(images, torch.Tensor):
+            groups = [(torch.arange(images.size(0)), images)]
+        else:  # images of the same size are processed together
+            shapes = {}
+            for i, img in enumerate(images):
+                shapes.setdefault(tuple(img.shape), []).append(i)
+            groups = [(torch.tensor(idx), torch.stack([images[i] for i in idx])) for idx in shapes.values()]
+
+        outputs = [(idx, self.crop(self.resize(x.float()), params['crop'][idx])) for idx, x in groups]
+        shapes = set(tuple(x.shape[1:]) for _, x in outputs)
+        if len(shapes) > 1:
+            raise ValueError('images of one batch have different sizes %s after preprocessing [%s]; use --batch_size 1 '
+                             'or a preprocess mode with cropping' % (sorted(shapes), self.opt.preprocess))
+        if len(outputs) == 1:
+            x = outputs[0][1]
+        else:
+            x = torch.empty((len(params['flip']),) + shapes.pop())
+            for idx, out in outputs:
+                x[idx] = out
+
+        if not self.opt.no_flip:
+            x = torch.where(params['flip'][:, None, None, None], x.flip(3), x)
+        if self.opt.uint8_transfer:  # the model normalizes the images on its device
+            return x.to(torch.uint8)
+        return x.div_(127.5).sub_(1.0)  # same as ToTensor + Normalize((0.5, ...), (0.5, ...))
+
+    def resize(self, x):
+        h, w = x.shape[-2:]
+        size = get_resize_size(self.opt, w, h)
+        if size == (h, w):
+            return x
+        x = F.interpolate(x, size=size, **self.interpolate_kwargs)
+        return x.clamp_(0, 255).round_()  # PIL resizes into uint8
+
+    def crop(self, x, pos):
+        if 'crop' not in self.opt.preprocess:
+            return x
+        n, c, h, w = x.shape
+        size = self.opt.crop_size
+        if h <= size and w <= size:
+            return x
+        assert h >= size and w >= size, 'image size (%d, %d) is smaller than crop_size %d' % (w, h, size)
+        x0 = (pos[:, 0] * (w - size + 1)).long()
+        y0 = (pos[:, 1] * (h - size + 1)).long()
+        rows = (y0[:, None] + torch.arange(size))[:, None, :, None].expand(n, c, size, w)
+        x = x.gather(2, rows)
+        cols = (x0[:, None] + torch.arange(size))[:, None, None, :].expand(n, c, size, size)
+        return x.gather(3, cols)
@@ -1,8 +1,6 @@
 import os
 from data.base_dataset import BaseDataset, get_transform
-from data.image_folder import make_dataset
 from skimage import color  # require skimage
-from PIL import Image
 import numpy as np
 import torchvision.transforms as transforms
 
@@ -37,7 +35,7 @@ class ColorizationDataset(BaseDataset):
         """
         BaseDataset.__init__(self, opt)
         self.dir = os.path.join(opt.dataroot, opt.phase)
-        self.AB_paths = sorted(make_dataset(self.dir, opt.max_dataset_size))
+        self.AB_paths = self.find_image_paths(self.dir)
         assert(opt.input_nc == 1 and opt.output_nc == 2 and opt.direction == 'AtoB')
         self.transform = get_transform(self.opt, convert=False)
 
@@ -54,7 +52,7 @@ class ColorizationDataset(BaseDataset):
             B_paths (str) - - image paths (same as A_paths)
         """
         path = self.AB_paths[index]
-        im = Image.open(path).convert('RGB')
+        im = self.load_image(path, allow_tensor=False)
         im = self.transform(im)
         im = np.array(im)
         lab = color.rgb2lab(im).astype(np.float32)
@@ -0,0 +1,76 @@
+"""An on-disk cache of images that are already converted and resized to load_size.
+
+With '--preprocess resize_and_crop' (or scale_width[_and_crop]), every image is decoded and resized from full
+resolution on every epoch, although only the random crop and flip change between epochs.
+Setting '--resize_cache_dir /path/to/cache' stores the output of <get_resize_transform> as raw uint8 arrays,
+so after the first epoch the workers only load the small array and apply crop and flip.
+
+Cache entries live in one subdirectory per (preprocess, load_size, crop_size, decode_backend) combination, since the
+fast decoder can produce slightly different pixels; their names
+include the path, size and modification time of the source image. Editing a source image therefore
+invalidates its entry automatically.
+"""
+import os
+import hashlib
+import numpy as np
+from PIL import Image
+import torchvision.transforms as transforms
+from data.base_dataset import get_resize_transform
+
+
+def create_resize_cache(opt):
+    """Return a ResizedImageCache if it is enabled and useful for opt.preprocess; otherwise None."""
+    if not opt.resize_cache_dir:
+        return None
+    if 'resize' not in opt.preprocess and 'scale_width' not in opt.preprocess:
+        return None
+    return ResizedImageCache(opt)
+
+
+def default_loader(path):
+    return Image.open(path).convert('RGB')
+
+
+class ResizedImageCache():
+    """This class stores pre-resized images on disk, keyed by the source file and the resize options."""
+
+    def __init__(self, opt):
+        """Initialize the cache.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        self.dir = os.path.join(opt.resize_cache_dir, '%s_load%d_crop%d_%s' % (opt.preprocess, opt.load_size, opt.crop_size, opt.decode_backend))
+        os.makedirs(self.dir, exist_ok=True)
+        self.transforms = {
+            False: transforms.Compose(get_resize_transform(opt, grayscale=False)),
+            True: transforms.Compose(get_resize_transform(opt, grayscale=True)),
+        }
+
+    def get_cache_path(self, path, grayscale, tag):
+        st = os.stat(path)
+        key = '%s|%s|%d|%d|%d' % (os.path.abspath(path), tag, grayscale, st.st_size, st.st_mtime_ns)
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.dir, key[:2], key + '.npy')
+
+    def get(self, path, grayscale=False, loader=default_loader, tag=''):
+        """Return the converted and resized PIL image of <path>.
+
+        Parameters:
+            path (str)       -- the source image path; its size and mtime validate the entry
+            grayscale (bool) -- if the image is converted to a single channel
+            loader (func)    -- called on a cache miss; returns the PIL image to resize
+            tag (str)        -- distinguishes several images derived from the same file (e.g., the A/B halves)
+        """
+        cache_path = self.get_cache_path(path, grayscale, tag)
+        try:
+            return Image.fromarray(np.load(cache_path))
+        except (OSError, ValueError):  # a missing or partially written entry
+            pass
+        img = self.transforms[grayscale](loader(path))
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:  # workers may race on the same entry; only publish complete files
+            np.save(f, np.asarray(img))
+        os.replace(tmp_path, cache_path)
+        return img
@@ -0,0 +1,63 @@
+"""Image decoding backends ('--decode_backend').
+
+'pil' (default) decodes every image at full resolution with Image.open(path).convert('RGB').
+'fast' avoids part of that work when the source images are much larger than load_size:
+  * JPEG files that are resized anyway are decoded directly at a reduced scale (1/2, 1/4 or 1/8) in the DCT domain
+    with PIL's <Image.draft>. The scale is the smallest one that keeps the image at least as large as the resize
+    target, so the following bicubic resize has less to downscale.
+  * JPEG files that are needed at full resolution (e.g., '--preprocess crop') are decoded with
+    torchvision.io.decode_jpeg straight into a uint8 tensor, when the caller accepts tensors
+    (i.e., with '--augment_backend tensor').
+  * All other files fall back to PIL.
+The reduced-scale decode is not bit-identical to decoding at full resolution and resizing, but it is visually equivalent.
+"""
+from PIL import Image
+try:
+    from torchvision.io import decode_jpeg, read_file, ImageReadMode
+except ImportError:  # old torchvision without the native JPEG decoder
+    decode_jpeg = None
+
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+def get_draft_size(opt, width_factor=1):
+    """Return the smallest (width, height) an image may be decoded at without losing resolution, or None.
+
+    Parameters:
+        opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        width_factor (int) -- how many images are stored side by side in one file (2 for aligned A|B images)
+
+    Returns None if opt.preprocess does not resize the images, so that they are needed at full resolution.
+    """
+    if 'resize' in opt.preprocess:
+        return opt.load_size * width_factor, opt.load_size
+    if 'scale_width' in opt.preprocess:  # the height follows the width
+        return opt.load_size * width_factor, 1
+    return None
+
+
+def load_image(path, opt, width_factor=1, allow_tensor=False):
+    """Load the image at <path> with opt.decode_backend.
+
+    Parameters:
+        path (str)          -- the image file
+        opt (Option class)  -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        width_factor (int)  -- how many images are stored side by side in one file (2 for aligned A|B images)
+        allow_tensor (bool) -- if the caller accepts a uint8 CxHxW tensor instead of a PIL image
+
+    Returns an RGB PIL image, or a uint8 3xHxW tensor if <allow_tensor> and the tensor decoder was used.
+    """
+    if opt.decode_backend == 'pil':
+        return Image.open(path).convert('RGB')
+
+    draft_size = get_draft_size(opt, width_factor)
+    if draft_size is None and allow_tensor and decode_jpeg is not None and path.lower().endswith(JPEG_EXTENSIONS):
+        try:
+            return decode_jpeg(read_file(path), mode=ImageReadMode.RGB)
+        except RuntimeError:  # e.g., CMYK or progressive files unsupported by the native decoder
+            pass
+    img = Image.open(path)
+    if draft_size is not None and img.format == 'JPEG':
+        img.draft('RGB', draft_size)
+    return img.convert('RGB')
+
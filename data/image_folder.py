@@ -8,6 +8,9 @@ import torch.utils.data as data
 
 from PIL import Image
 import os
+import json
+import hashlib
+from multiprocessing.pool import ThreadPool
 
 IMG_EXTENSIONS = [
     '.jpg', '.JPG', '.jpeg', '.JPEG',
@@ -20,10 +23,23 @@ def is_image_file(filename):
     return any(filename.endswith(extension) for extension in IMG_EXTENSIONS)
 
 
-def make_dataset(dir, max_dataset_size=float("inf")):
-    images = []
+def make_dataset(dir, max_dataset_size=float("inf"), use_manifest=False, manifest_dir='', verify=False, num_workers=4):
+    """Return the image paths under <dir> and its subdirectories.
+
+    Parameters:
+        dir (str)              -- the image directory
+        max_dataset_size (int) -- the maximum number of returned paths
+        use_manifest (bool)    -- read and refresh a persisted manifest instead of walking the whole tree (see ImageManifest)
+        manifest_dir (str)     -- where the manifest is stored; see ImageManifest for the default
+        verify (bool)          -- decode every image once and drop the corrupt ones (implies use_manifest)
+        num_workers (int)      -- the number of threads that read image headers or decode images for the manifest
+    """
     assert os.path.isdir(dir), '%s is not a valid directory' % dir
+    if use_manifest or verify:
+        images = ImageManifest(dir, manifest_dir).refresh(verify, num_workers).get_paths()
+        return images[:min(max_dataset_size, len(images))]
 
+    images = []
     for root, _, fnames in sorted(os.walk(dir)):
         for fname in fnames:
             if is_image_file(fname):
@@ -32,6 +48,161 @@ def make_dataset(dir, max_dataset_size=float("inf")):
     return images[:min(max_dataset_size, len(images))]
 
 
+def get_image_sizes(dir, paths, use_manifest=False, manifest_dir='', num_workers=4):
+    """Return the (width, height) of every image in <paths>, which were found under <dir>.
+
+    The sizes come from the manifest of <dir> if use_manifest is set; otherwise, the image headers are read in parallel.
+    """
+    if use_manifest:
+        manifest = ImageManifest(dir, manifest_dir)
+        sizes = [manifest.get_size(path) for path in paths]
+    else:
+        sizes = [None] * len(paths)
+    missing = [i for i, size in enumerate(sizes) if size is None]
+    if missing:
+        with ThreadPool(max(1, num_workers)) as pool:
+            infos = pool.starmap(_read_image_info, [(paths[i], False) for i in missing])
+        for i, (w, h, _) in zip(missing, infos):
+            sizes[i] = (w, h)
+    return sizes
+
+
+def _read_image_info(path, verify):
+    """Return (width, height, ok) of an image; decode the whole image if <verify>."""
+    try:
+        with Image.open(path) as img:
+            if verify:
+                img.load()
+            return img.size[0], img.size[1], True
+    except Exception:  # any decoding error marks the file as corrupt
+        return 0, 0, False
+
+
+class ImageManifest():
+    """A persisted listing of an image directory: relative paths, sizes, mtimes and decoded dimensions.
+
+    Walking a large tree on a network filesystem is slow, so the manifest records the mtime of every
+    subdirectory and only lists the subdirectories whose mtime changed since the last refresh.
+    Files in changed subdirectories keep their records if their size and mtime did not change.
+    Corrupt images found by the optional decode check are remembered and excluded from <get_paths>.
+
+    A file rewritten in place does not change the mtime of its directory, so it is only noticed when every
+    file is stat'ed again, which <refresh> does with verify=True.
+    The manifest is stored outside the image directory, so that saving it does not change the directory mtime.
+    """
+
+    VERSION = 1
+
+    def __init__(self, dir, manifest_dir=''):
+        """Load the manifest of <dir> if it exists.
+
+        Parameters:
+            dir (str)          -- the image directory
+            manifest_dir (str) -- where the manifest is stored; $XDG_CACHE_HOME/image_manifests (~/.cache/image_manifests) by default
+        """
+        self.root = dir
+        self.dir = os.path.abspath(dir)
+        if not manifest_dir:
+            manifest_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'image_manifests')
+        self.path = os.path.join(manifest_dir, hashlib.sha1(self.dir.encode('utf-8')).hexdigest() + '.json')
+        self.dirs, self.files = {}, {}
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == self.VERSION and manifest.get('root') == self.dir:
+                self.dirs, self.files = manifest['dirs'], manifest['files']
+        except (OSError, ValueError):  # no manifest yet, or an unreadable one; start from scratch
+            pass
+
+    def refresh(self, verify=False, num_workers=4):
+        """Bring the manifest up to date with the directory and save it.
+
+        Parameters:
+            verify (bool)     -- decode every image that has not been verified yet; also stat the files of unchanged
+                                 directories, to find the images rewritten in place
+            num_workers (int) -- the number of threads reading the images
+        """
+        dirs, files, todo = {}, {}, []
+
+        def add_file(rel_path, st):  # keep the record of an unchanged file; otherwise, read the image again
+            old = self.files.get(rel_path)
+            if old is not None and old['size'] == st.st_size and old['mtime'] == st.st_mtime_ns:
+                files[rel_path] = old
+            else:
+                files[rel_path] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'width': 0, 'height': 0, 'verified': False, 'corrupt': False}
+                todo.append(rel_path)
+
+        stack = ['']
+        while stack:
+            rel_root = stack.pop()
+            mtime = os.stat(os.path.join(self.dir, rel_root)).st_mtime_ns
+            record = self.dirs.get(rel_root)
+            if record is not None and record['mtime'] == mtime:  # unchanged directory; reuse its listing
+                dirs[rel_root] = record
+                for fname in record['files']:
+                    rel_path = os.path.join(rel_root, fname)
+                    if verify:
+                        add_file(rel_path, os.stat(os.path.join(self.dir, rel_path)))
+                    else:
+                        files[rel_path] = self.files[rel_path]
+            else:
+                record = {'mtime': mtime, 'files': [], 'subdirs': []}
+                for entry in os.scandir(os.path.join(self.dir, rel_root)):
+                    if entry.is_dir():
+                        record['subdirs'].append(entry.name)
+                    elif is_image_file(entry.name):
+                        add_file(os.path.join(rel_root, entry.name), entry.stat())
+                        record['files'].append(entry.name)
+                dirs[rel_root] = record
+            stack.extend(os.path.join(rel_root, d) for d in record['subdirs'])
+        if verify:
+            todo = [p for p, info in files.items() if not info['verified']]
+
+        if todo:  # read headers (or decode) the new and changed images in parallel
+            with ThreadPool(max(1, num_workers)) as pool:
+                infos = pool.starmap(_read_image_info, [(os.path.join(self.dir, p), verify) for p in todo])
+            for rel_path, (w, h, ok) in zip(todo, infos):
+                info = files[rel_path]
+                info.update(width=w, height=h, corrupt=not ok, verified=verify or info['verified'] or not ok)
+            corrupt = [p for p in todo if files[p]['corrupt']]
+            if corrupt:
+                print('found %d corrupt image(s) in %s, e.g. %s; they will be skipped' % (len(corrupt), self.dir, corrupt[0]))
+
+        changed = todo or dirs.keys() != self.dirs.keys() or any(dirs[d]['mtime'] != self.dirs[d]['mtime'] for d in dirs)
+        self.dirs, self.files = dirs, files
+        if changed:
+            self.save()
+        return self
+
+    def save(self):
+        """Write the manifest atomically; print a warning if its location is not writable."""
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': self.VERSION, 'root': self.dir, 'dirs': self.dirs, 'files': self.files}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print('could not save the image manifest to %s (%s); use --manifest_dir to choose a writable location' % (self.path, e))
+
+    def get_paths(self):
+        """Return the paths of all the readable images, in the same order as <make_dataset> without a manifest."""
+        paths = []
+        for rel_root in sorted(self.dirs, key=lambda d: os.path.join(self.dir, d)):
+            for fname in self.dirs[rel_root]['files']:
+                rel_path = os.path.join(rel_root, fname)
+                if not self.files[rel_path]['corrupt']:
+                    paths.append(os.path.join(self.root, rel_path))
+        return paths
+
+    def get_size(self, path):
+        """Return the (width, height) of an image recorded in the manifest, or None if it is unknown."""
+        info = self.files.get(os.path.relpath(os.path.abspath(path), self.dir))
+        if info is None or info['width'] == 0:
+            return None
+        return info['width'], info['height']
+
+
 def default_loader(path):
     return Image.open(path).convert('RGB')
 
@@ -0,0 +1,211 @@
+"""Dataset class for images that were pre-decoded into memory-mapped shard files.
+
+Decoding JPEG/PNG files dominates the loading time on large domains. This module stores every image of a
+directory as a raw uint8 HxWx3 array inside a few large shard files, together with an offset index.
+Workers slice the images straight out of the memory map, so no decoding happens during training.
+
+Create the packs once with 'datasets/pack_dataset.py':
+    python datasets/pack_dataset.py --dataroot ./datasets/maps
+and train with '--dataset_mode packed'. Both unaligned ('trainA'/'trainB') and aligned ('train') data are supported;
+choose with '--packed_layout'.
+"""
+import os
+import random
+import numpy as np
+from PIL import Image
+from data.base_dataset import BaseDataset, get_params, get_transform
+from data.image_folder import make_dataset
+from data.samplers import get_output_size, match_shape_buckets
+
+INDEX_NAME = 'index.npz'
+SHARD_NAME = 'shard_%05d.bin'
+
+
+def _decode_rgb(path):
+    return np.asarray(Image.open(path).convert('RGB'), dtype=np.uint8)
+
+
+def pack_image_folder(dir, pack_dir, shard_size=1 << 30, max_dataset_size=float("inf"), pool=None):
+    """Decode all the images under <dir> and write them into shard files under <pack_dir>.
+
+    Parameters:
+        dir (str)              -- the image directory, e.g. '/path/to/data/trainA'
+        pack_dir (str)         -- the output directory, e.g. '/path/to/data/packed/trainA'
+        shard_size (int)       -- the maximum number of bytes per shard file
+        max_dataset_size (int) -- the maximum number of images to pack
+        pool                   -- an optional multiprocessing pool used for decoding
+
+    Returns the number of packed images.
+    """
+    paths = sorted(make_dataset(dir, max_dataset_size))
+    os.makedirs(pack_dir, exist_ok=True)
+    entries = np.zeros((len(paths), 4), dtype=np.int64)  # (shard, offset, height, width)
+    images = pool.imap(_decode_rgb, paths, chunksize=16) if pool is not None else map(_decode_rgb, paths)
+    shard_id, offset = 0, 0
+    shard = open(os.path.join(pack_dir, SHARD_NAME % shard_id), 'wb')
+    try:
+        for i, img in enumerate(images):
+            if offset > 0 and offset + img.nbytes > shard_size:  # start a new shard
+                shard.close()
+                shard_id, offset = shard_id + 1, 0
+                shard = open(os.path.join(pack_dir, SHARD_NAME % shard_id), 'wb')
+            shard.write(img.tobytes())
+            entries[i] = (shard_id, offset, img.shape[0], img.shape[1])
+            offset += img.nbytes
+    finally:
+        shard.close()
+    np.savez(os.path.join(pack_dir, INDEX_NAME), entries=entries, paths=np.array(paths))
+    return len(paths)
+
+
+class PackedImageStore():
+    """Read-only access to the images of one pack directory.
+
+    The shard files are memory-mapped lazily, so that every DataLoader worker opens its own maps.
+    """
+
+    def __init__(self, pack_dir, max_dataset_size=float("inf")):
+        """Load the offset index of a pack directory.
+
+        Parameters:
+            pack_dir (str)         -- a directory written by <pack_image_folder>
+            max_dataset_size (int) -- the maximum number of images to expose
+        """
+        index_path = os.path.join(pack_dir, INDEX_NAME)
+        assert os.path.isfile(index_path), '%s is not a valid pack directory' % pack_dir
+        index = np.load(index_path)
+        size = int(min(max_dataset_size, len(index['paths'])))
+        self.pack_dir = pack_dir
+        self.entries = index['entries'][:size]
+        self.paths = [str(p) for p in index['paths'][:size]]
+        self.shards = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shards'] = {}  # never pickle the maps; each worker reopens them
+        return state
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get_array(self, index):
+        """Return the image <index> as a HxWx3 uint8 array view of the memory map (no copy)."""
+        shard_id, offset, h, w = (int(v) for v in self.entries[index])
+        if shard_id not in self.shards:
+            self.shards[shard_id] = np.memmap(os.path.join(self.pack_dir, SHARD_NAME % shard_id), dtype=np.uint8, mode='r')
+        return self.shards[shard_id][offset:offset + h * w * 3].reshape(h, w, 3)
+
+    def get_sizes(self):
+        """Return the (width, height) of every image, from the index."""
+        return [(int(w), int(h)) for h, w in self.entries[:, 2:4]]
+
+    def get_image(self, index):
+        """Return the image <index> as a PIL RGB image."""
+        return Image.fromarray(self.get_array(index))
+
+
+class PackedDataset(BaseDataset):
+    """This dataset class loads images from the shard files written by 'datasets/pack_dataset.py'.
+
+    With '--packed_layout unaligned', it reads '/path/to/data/packed/trainA' and '/path/to/data/packed/trainB' like the
+    unaligned dataset; with '--packed_layout aligned', it reads '/path/to/data/packed/train' like the aligned dataset.
+    """
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        """Add new dataset-specific options, and rewrite default values for existing options.
+
+        Parameters:
+            parser          -- original option parser
+            is_train (bool) -- whether training phase or test phase. You can use this flag to add training-specific or test-specific options.
+
+        Returns:
+            the modified parser.
+        """
+        parser.add_argument('--packed_root', type=str, default='', help='directory with the packed shards; [dataroot]/packed by default')
+        parser.add_argument('--packed_layout', type=str, default='unaligned', choices=['unaligned', 'aligned'], help='which packs to read [unaligned | aligned]. unaligned: [phase]A and [phase]B, e.g. for cycle_gan; aligned: the A|B images of [phase], e.g. for pix2pix')
+        return parser
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        BaseDataset.__init__(self, opt)
+        packed_root = opt.packed_root or os.path.join(opt.dataroot, 'packed')
+        dir_A = os.path.join(packed_root, opt.phase + 'A')
+        dir_B = os.path.join(packed_root, opt.phase + 'B')
+        btoA = self.opt.direction == 'BtoA'
+        self.input_nc = self.opt.output_nc if btoA else self.opt.input_nc
+        self.output_nc = self.opt.input_nc if btoA else self.opt.output_nc
+        self.aligned = opt.packed_layout == 'aligned'
+        if self.aligned:
+            dir_AB = os.path.join(packed_root, opt.phase)
+            assert os.path.isdir(dir_AB), '--packed_layout aligned needs the pack directory %s' % dir_AB
+            self.store_AB = PackedImageStore(dir_AB, opt.max_dataset_size)
+            assert(self.opt.load_size >= self.opt.crop_size)   # crop_size should be smaller than the size of loaded image
+        else:
+            assert os.path.isdir(dir_A) and os.path.isdir(dir_B), '--packed_layout unaligned needs the pack directories %s and %s' % (dir_A, dir_B)
+            self.store_A = PackedImageStore(dir_A, opt.max_dataset_size)
+            self.store_B = PackedImageStore(dir_B, opt.max_dataset_size)
+            self.A_size = len(self.store_A)
+            self.B_size = len(self.store_B)
+            self.transform_A = get_transform(self.opt, grayscale=(self.input_nc == 1))
+            self.transform_B = get_transform(self.opt, grayscale=(self.output_nc == 1))
+            if opt.bucket_by_shape:  # a batch of same-shape A images needs B images of one shape, too
+                self.A_shapes = [get_output_size(opt, w, h) for w, h in self.store_A.get_sizes()]
+                B_shapes = [get_output_size(opt, w, h) for w, h in self.store_B.get_sizes()]
+                self.B_bucket_of = match_shape_buckets(self.A_shapes, B_shapes)
+
+    def __getitem__(self, index):
+        """Return a data point and its metadata information.
+
+        Parameters:
+            index (int)      -- a random integer for data indexing, or an (index_A, index_B) pair from --pair_sampler
+
+        Returns a dictionary that contains A, B, A_paths and B_paths
+            A (tensor)       -- an image in the input domain
+            B (tensor)       -- its corresponding image in the target domain
+            A_paths (str)    -- the original image path
+            B_paths (str)    -- the original image path
+        """
+        if self.aligned:
+            AB = self.store_AB.get_array(index)
+            w2 = AB.shape[1] // 2
+            A = Image.fromarray(AB[:, :w2])
+            B = Image.fromarray(AB[:, w2:])
+            transform_params = get_params(self.opt, A.size)
+            A = get_transform(self.opt, transform_params, grayscale=(self.input_nc == 1))(A)
+            B = get_transform(self.opt, transform_params, grayscale=(self.output_nc == 1))(B)
+            AB_path = self.store_AB.paths[index]
+            return {'A': A, 'B': B, 'A_paths': AB_path, 'B_paths': AB_path}
+
+        if isinstance(index, tuple):  # both indices were drawn by the sampler
+            index_A, index_B = index
+        else:
+            index_A = index % self.A_size   # make sure index is within then range
+            B_indices = self.B_bucket_of[self.A_shapes[index_A]] if self.opt.bucket_by_shape else range(self.B_size)
+            if self.opt.serial_batches:
+                index_B = B_indices[index % len(B_indices)]
+            else:   # randomize the index for domain B to avoid fixed pairs.
+                index_B = B_indices[random.randint(0, len(B_indices) - 1)]
+        A = self.transform_A(self.store_A.get_image(index_A))
+        B = self.transform_B(self.store_B.get_image(index_B))
+        return {'A': A, 'B': B, 'A_paths': self.store_A.paths[index_A], 'B_paths': self.store_B.paths[index_B]}
+
+    def get_shape_keys(self):
+        """Return the output shape of every data point, from the image sizes stored in the pack index."""
+        if self.aligned:
+            return [get_output_size(self.opt, int(w / 2), h) for w, h in self.store_AB.get_sizes()]
+        return [self.A_shapes[index % self.A_size] for index in range(len(self))]
+
+    def get_domain_sizes(self):
+        assert not self.aligned, '--pair_sampler needs unaligned data'
+        return self.A_size, self.B_size
+
+    def __len__(self):
+        """Return the total number of images in the dataset."""
+        if self.aligned:
+            return len(self.store_AB)
+        return max(self.A_size, self.B_size)
@@ -0,0 +1,148 @@
+"""Samplers for <CustomDatasetDataLoader>.
+
+With '--preprocess scale_width' or 'none', images keep their aspect ratio, so a batch of random images usually
+mixes several shapes and cannot be collated. '--bucket_by_shape' groups the images by the shape they have after
+preprocessing (see <get_output_size>) and only batches images from the same group, so batch_size > 1 works.
+
+'--pair_sampler' draws the (A, B) index pairs of unaligned datasets in the main process, once per epoch,
+instead of picking B with random.randint in the workers (see <UnalignedPairSampler>).
+"""
+import math
+import torch
+from data.batch_transform import get_resize_size
+
+
+def get_output_size(opt, w, h):
+    """Return the (height, width) of a w x h source image after resizing and cropping by opt.preprocess.
+
+    It mirrors <get_transform>; flipping does not change the shape.
+    """
+    h, w = get_resize_size(opt, w, h)
+    if 'crop' in opt.preprocess and (w > opt.crop_size or h > opt.crop_size):
+        return opt.crop_size, opt.crop_size
+    return h, w
+
+
+def match_shape_buckets(A_shapes, B_shapes):
+    """Return a dict that maps every A output shape to the indices of the B images with the closest aspect ratio (and area).
+
+    Unaligned datasets draw B from the bucket of the A image, so that a batch of same-shape A images has B images
+    of one shape, too.
+    """
+    B_buckets = {}
+    for index_B, shape in enumerate(B_shapes):
+        B_buckets.setdefault(shape, []).append(index_B)
+    B_bucket_of = {}
+    for shape in set(A_shapes):
+        closest = min(B_buckets, key=lambda s: (abs(math.log(s[0] * shape[1] / (s[1] * shape[0]))), abs(s[0] * s[1] - shape[0] * shape[1])))
+        B_bucket_of[shape] = B_buckets[closest]
+    return B_bucket_of
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """Yield batches of dataset indices whose images share the same output shape.
+
+    Every epoch, the indices of each shape are shuffled and split into batches, and the order of all batches
+    is shuffled, so that the shapes are interleaved. Only the last batch of each shape can be smaller than batch_size.
+    """
+
+    def __init__(self, shape_keys, batch_size, shuffle=True, drop_last=False):
+        """Group the dataset indices by shape.
+
+        Parameters:
+            shape_keys (list) -- the output shape (or any hashable key) of every dataset index
+            batch_size (int)  -- the maximum number of indices per batch
+            shuffle (bool)    -- if the indices and the batches are shuffled every epoch
+            drop_last (bool)  -- if the incomplete last batch of every shape is dropped
+        """
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        buckets = {}
+        for index, key in enumerate(shape_keys):
+            buckets.setdefault(key, []).append(index)
+        self.buckets = list(buckets.values())
+        print('%d images in %d shape buckets' % (len(shape_keys), len(self.buckets)))
+
+    def __iter__(self):
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = [bucket[i] for i in torch.randperm(len(bucket)).tolist()]
+            for start in range(0, len(bucket), self.batch_size):
+                batch = bucket[start:start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+        return iter(batches)
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(len(bucket) // self.batch_size for bucket in self.buckets)
+        return sum(math.ceil(len(bucket) / self.batch_size) for bucket in self.buckets)
+
+
+def get_rank_info():
+    """Return (rank, world size) of this process; (0, 1) without torch.distributed."""
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+    return 0, 1
+
+
+class UnalignedPairSampler(torch.utils.data.Sampler):
+    """Yield (index_A, index_B) pairs for unaligned datasets, drawn per epoch from a seeded generator.
+
+    An epoch has max(A_size, B_size) pairs. Each domain is a concatenation of random permutations of its
+    indices, so every image is used equally often, and the pairing is random. The pairs only depend on the seed
+    and the epoch, not on the number of workers. With torch.distributed, every process gets a disjoint slice of them.
+    """
+
+    def __init__(self, A_size, B_size, shuffle=True, seed=0, rank=None, world_size=None):
+        """Initialize the sampler.
+
+        Parameters:
+            A_size (int)     -- the number of images in domain A
+            B_size (int)     -- the number of images in domain B
+            shuffle (bool)   -- if False, pair index i with (i % A_size, i % B_size) like --serial_batches
+            seed (int)       -- the seed of the permutations; epoch e uses seed + e
+            rank (int)       -- the index of this process; taken from torch.distributed by default
+            world_size (int) -- the number of processes; taken from torch.distributed by default
+        """
+        if rank is None or world_size is None:
+            rank, world_size = get_rank_info()
+        self.A_size = A_size
+        self.B_size = B_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        self.length = max(A_size, B_size)
+        self.num_samples = math.ceil(self.length / world_size)
+
+    def set_epoch(self, epoch):
+        """Choose the epoch of the next iteration; otherwise, every iteration starts a new epoch."""
+        self.epoch = epoch
+
+    def permute(self, size, generator):
+        """Return <self.length> indices of [0, size): concatenated random permutations, computed in one step."""
+        num_perms = math.ceil(self.length / size)
+        return torch.rand(num_perms, size, generator=generator).argsort(dim=1).flatten()[:self.length]
+
+    def __iter__(self):
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            A = self.permute(self.A_size, generator)
+            B = self.permute(self.B_size, generator)
+        else:
+            A = torch.arange(self.length) % self.A_size
+            B = torch.arange(self.length) % self.B_size
+        self.epoch += 1
+        # pad to a multiple of the world size (like DistributedSampler), then take this process' slice
+        index = (torch.arange(self.num_samples * self.world_size) % self.length)[self.rank::self.world_size]
+        return iter(zip(A[index].tolist(), B[index].tolist()))
+
+    def __len__(self):
+        return self.num_samples
@@ -1,6 +1,6 @@
 from data.base_dataset import BaseDataset, get_transform
-from data.image_folder import make_dataset
-from PIL import Image
+from data.image_cache import create_resize_cache
+from data.samplers import get_output_size
 
 
 class SingleDataset(BaseDataset):
@@ -16,9 +16,11 @@ class SingleDataset(BaseDataset):
             opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
         """
         BaseDataset.__init__(self, opt)
-        self.A_paths = sorted(make_dataset(opt.dataroot, opt.max_dataset_size))
+        self.A_paths = self.find_image_paths(opt.dataroot)
         input_nc = self.opt.output_nc if self.opt.direction == 'BtoA' else self.opt.input_nc
-        self.transform = get_transform(opt, grayscale=(input_nc == 1))
+        self.grayscale = input_nc == 1
+        self.resize_cache = create_resize_cache(opt)
+        self.transform = get_transform(opt, grayscale=self.grayscale, resized=self.resize_cache is not None)
 
     def __getitem__(self, index):
         """Return a data point and its metadata information.
@@ -31,10 +33,17 @@ class SingleDataset(BaseDataset):
             A_paths(str) - - the path of the image
         """
         A_path = self.A_paths[index]
-        A_img = Image.open(A_path).convert('RGB')
+        if self.resize_cache is not None:
+            A_img = self.resize_cache.get(A_path, self.grayscale, loader=lambda path: self.load_image(path, allow_tensor=False))
+        else:
+            A_img = self.load_image(A_path)
         A = self.transform(A_img)
         return {'A': A, 'A_paths': A_path}
 
+    def get_shape_keys(self):
+        """Return the output shape of every data point."""
+        return [get_output_size(self.opt, w, h) for w, h in self.find_image_sizes(self.opt.dataroot, self.A_paths)]
+
     def __len__(self):
         """Return the total number of images in the dataset."""
         return len(self.A_paths)
@@ -0,0 +1,183 @@
+"""Dataset class that streams unaligned images from tar archives.
+
+Millions of small files are slow to access randomly on shared storage. This dataset reads the images sequentially
+from a few large tar shards instead, and randomizes their order with a shuffle buffer:
+    /path/to/data/trainA/*.tar  -- images from domain A
+    /path/to/data/trainB/*.tar  -- images from domain B
+Any tar file of image files works, e.g. 'tar cf trainA/shard_0000.tar -C /path/to/images/trainA .'.
+Use '--dataset_mode tar'. It yields the same data points as the unaligned dataset.
+
+The shards are split across the DataLoader workers and the distributed processes, so that every shard is read
+by exactly one of them; if there are fewer shards than readers, every reader keeps every n-th image instead.
+With --max_dataset_size, only the first images of the sorted shards are read, like the first files of a folder.
+
+The number of images per shard is stored in 'tar_index.json' next to the shards, so that the archives are only
+scanned again when they change.
+"""
+import io
+import os
+import glob
+import json
+import random
+import tarfile
+import torch.utils.data as data
+from PIL import Image
+from data.base_dataset import BaseDataset, get_transform
+from data.image_folder import is_image_file
+from data.samplers import get_rank_info
+
+
+def find_tar_shards(dir):
+    """Return the sorted tar files in <dir>."""
+    assert os.path.isdir(dir), '%s is not a valid directory' % dir
+    shards = sorted(glob.glob(os.path.join(dir, '*.tar')))
+    assert len(shards) > 0, 'no tar files found in %s' % dir
+    return shards
+
+
+def count_tar_images(shards):
+    """Return the number of image files in every tar shard.
+
+    The counts are read from the index next to the shards; shards that are new or whose size or mtime changed
+    are scanned (only the member headers are read) and the index is updated.
+    """
+    index_path = os.path.join(os.path.dirname(shards[0]), 'tar_index.json')
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):  # no index yet, or an unreadable one
+        index = {}
+    counts, changed = [], False
+    for shard in shards:
+        st = os.stat(shard)
+        record = index.get(os.path.basename(shard))
+        if record is None or record['size'] != st.st_size or record['mtime'] != st.st_mtime_ns:
+            with tarfile.open(shard) as tar:
+                count = sum(1 for member in tar if member.isfile() and is_image_file(member.name))
+            record = index[os.path.basename(shard)] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'count': count}
+            changed = True
+        counts.append(record['count'])
+    if changed:
+        tmp_path = '%s.%d.tmp' % (index_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print('could not save the tar index to %s (%s); the shards will be counted again on the next start' % (index_path, e))
+    return counts
+
+
+def get_reader_info():
+    """Return (reader id, number of readers) over all DataLoader workers of all distributed processes."""
+    rank, world_size = get_rank_info()
+    worker_info = data.get_worker_info()
+    worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+    return rank * num_workers + worker_id, world_size * num_workers
+
+
+class TarDataset(BaseDataset, data.IterableDataset):
+    """This dataset class streams unaligned data points from tar shards under '/path/to/data/trainA' and '/path/to/data/trainB'."""
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        """Add new dataset-specific options, and rewrite default values for existing options.
+
+        Parameters:
+            parser          -- original option parser
+            is_train (bool) -- whether training phase or test phase. You can use this flag to add training-specific or test-specific options.
+
+        Returns:
+            the modified parser.
+        """
+        parser.add_argument('--shuffle_buffer', type=int, default=1000, help='number of encoded images each reader keeps per domain to shuffle the streams; 0 disables shuffling')
+        return parser
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        BaseDataset.__init__(self, opt)
+        self.A_shards = find_tar_shards(os.path.join(opt.dataroot, opt.phase + 'A'))
+        self.B_shards = find_tar_shards(os.path.join(opt.dataroot, opt.phase + 'B'))
+        self.A_limits = self.get_shard_limits(count_tar_images(self.A_shards))
+        self.B_limits = self.get_shard_limits(count_tar_images(self.B_shards))
+        self.A_size = int(sum(self.A_limits))
+        self.B_size = int(sum(self.B_limits))
+        self.shuffle = not opt.serial_batches and opt.shuffle_buffer > 0
+        btoA = self.opt.direction == 'BtoA'
+        input_nc = self.opt.output_nc if btoA else self.opt.input_nc       # get the number of channels of input image
+        output_nc = self.opt.input_nc if btoA else self.opt.output_nc      # get the number of channels of output image
+        self.transform_A = get_transform(self.opt, grayscale=(input_nc == 1))
+        self.transform_B = get_transform(self.opt, grayscale=(output_nc == 1))
+
+    def __iter__(self):
+        """Yield this reader's share of the data points, as dictionaries with A, B, A_paths and B_paths.
+
+        All readers yield the same number of data points, so an epoch is about one pass over the larger domain:
+        readers with fewer images repeat some of them. The shorter domain is repeated, as in the unaligned dataset.
+        """
+        reader_id, num_readers = get_reader_info()
+        num_samples = len(self) // num_readers + (reader_id < len(self) % num_readers)
+        A_stream = self.shuffle_samples(self.read_samples(self.A_shards, self.A_limits, reader_id, num_readers))
+        B_stream = self.shuffle_samples(self.read_samples(self.B_shards, self.B_limits, reader_id, num_readers))
+        for _ in range(num_samples):
+            A_path, A_bytes = next(A_stream)
+            B_path, B_bytes = next(B_stream)
+            A = self.transform_A(Image.open(io.BytesIO(A_bytes)).convert('RGB'))
+            B = self.transform_B(Image.open(io.BytesIO(B_bytes)).convert('RGB'))
+            yield {'A': A, 'B': B, 'A_paths': A_path, 'B_paths': B_path}
+
+    def get_shard_limits(self, counts):
+        """Return how many images are read from every shard, so that only the first opt.max_dataset_size images are used."""
+        limits, offset = [], 0
+        for count in counts:
+            limits.append(int(max(0, min(count, self.opt.max_dataset_size - offset))))
+            offset += count
+        return limits
+
+    def read_samples(self, shards, limits, reader_id, num_readers):
+        """Endlessly yield (path, encoded image) pairs of this reader from the tar shards.
+
+        Only the first <limits[i]> images of shard i are read.
+        Each pass over the shards visits them in a new random order (unless --serial_batches).
+        """
+        shards = [(shard, limit) for shard, limit in zip(shards, limits) if limit > 0]
+        if len(shards) >= num_readers:  # every reader streams its own shards
+            shards, stride = shards[reader_id::num_readers], 1
+        else:  # every reader streams all the shards and keeps every n-th image
+            stride = num_readers
+        while True:
+            found = False
+            for shard, limit in (random.sample(shards, len(shards)) if self.shuffle else shards):
+                with tarfile.open(shard, 'r|*') as tar:  # sequential access only
+                    for i, member in enumerate(m for m in tar if m.isfile() and is_image_file(m.name)):
+                        if i >= limit:
+                            break
+                        if i % stride == reader_id % stride:
+                            found = True
+                            yield os.path.join(shard, os.path.normpath(member.name)), tar.extractfile(member).read()
+            assert found, 'no images found for reader %d in %s' % (reader_id, shards)
+
+    def shuffle_samples(self, samples):
+        """Shuffle an endless stream with a buffer of opt.shuffle_buffer elements."""
+        if not self.shuffle:
+            yield from samples
+            return
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.opt.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            i = random.randint(0, len(buffer) - 1)
+            yield buffer[i]
+            buffer[i] = sample
+
+    def __getitem__(self, index):
+        raise TypeError('%s only supports iteration' % type(self).__name__)
+
+    def __len__(self):
+        """Return the total number of data points per epoch."""
+        return max(self.A_size, self.B_size)
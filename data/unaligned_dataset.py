@@ -1,7 +1,7 @@
 import os
 from data.base_dataset import BaseDataset, get_transform
-from data.image_folder import make_dataset
-from PIL import Image
+from data.image_cache import create_resize_cache
+from data.samplers import get_output_size, match_shape_buckets
 import random
 
 
@@ -26,21 +26,29 @@ class UnalignedDataset(BaseDataset):
         self.dir_A = os.path.join(opt.dataroot, opt.phase + 'A')  # create a path '/path/to/data/trainA'
         self.dir_B = os.path.join(opt.dataroot, opt.phase + 'B')  # create a path '/path/to/data/trainB'
 
-        self.A_paths = sorted(make_dataset(self.dir_A, opt.max_dataset_size))   # load images from '/path/to/data/trainA'
-        self.B_paths = sorted(make_dataset(self.dir_B, opt.max_dataset_size))    # load images from '/path/to/data/trainB'
+        self.A_paths = self.find_image_paths(self.dir_A)   # load images from '/path/to/data/trainA'
+        self.B_paths = self.find_image_paths(self.dir_B)    # load images from '/path/to/data/trainB'
         self.A_size = len(self.A_paths)  # get the size of dataset A
         self.B_size = len(self.B_paths)  # get the size of dataset B
         btoA = self.opt.direction == 'BtoA'
         input_nc = self.opt.output_nc if btoA else self.opt.input_nc       # get the number of channels of input image
         output_nc = self.opt.input_nc if btoA else self.opt.output_nc      # get the number of channels of output image
-        self.transform_A = get_transform(self.opt, grayscale=(input_nc == 1))
-        self.transform_B = get_transform(self.opt, grayscale=(output_nc == 1))
+        self.grayscale_A = input_nc == 1
+        self.grayscale_B = output_nc == 1
+        self.resize_cache = create_resize_cache(opt)
+        resized = self.resize_cache is not None
+        self.transform_A = get_transform(self.opt, grayscale=self.grayscale_A, resized=resized)
+        self.transform_B = get_transform(self.opt, grayscale=self.grayscale_B, resized=resized)
+        if opt.bucket_by_shape:  # a batch of same-shape A images needs B images of one shape, too
+            self.A_shapes = [get_output_size(opt, w, h) for w, h in self.find_image_sizes(self.dir_A, self.A_paths)]
+            B_shapes = [get_output_size(opt, w, h) for w, h in self.find_image_sizes(self.dir_B, self.B_paths)]
+            self.B_bucket_of = match_shape_buckets(self.A_shapes, B_shapes)  # A shape -> indices of the matching B images
 
     def __getitem__(self, index):
         """Return a data point and its metadata information.
 
         Parameters:
-            index (int)      -- a random integer for data indexing
+            index (int)      -- a random integer for data indexing, or an (index_A, index_B) pair from --pair_sampler
 
         Returns a dictionary that contains A, B, A_paths and B_paths
             A (tensor)       -- an image in the input domain
@@ -48,20 +56,38 @@ class UnalignedDataset(BaseDataset):
             A_paths (str)    -- image paths
             B_paths (str)    -- image paths
         """
+        if isinstance(index, tuple):  # both indices were drawn by the sampler
+            index_A, index_B = index
+            return self.get_pair(self.A_paths[index_A], self.B_paths[index_B])
         A_path = self.A_paths[index % self.A_size]  # make sure index is within then range
+        B_indices = self.B_bucket_of[self.A_shapes[index % self.A_size]] if self.opt.bucket_by_shape else range(self.B_size)
         if self.opt.serial_batches:   # make sure index is within then range
-            index_B = index % self.B_size
+            index_B = B_indices[index % len(B_indices)]
         else:   # randomize the index for domain B to avoid fixed pairs.
-            index_B = random.randint(0, self.B_size - 1)
-        B_path = self.B_paths[index_B]
-        A_img = Image.open(A_path).convert('RGB')
-        B_img = Image.open(B_path).convert('RGB')
+            index_B = B_indices[random.randint(0, len(B_indices) - 1)]
+        return self.get_pair(A_path, self.B_paths[index_B])
+
+    def get_pair(self, A_path, B_path):
+        """Load and transform the images of a data point."""
+        if self.resize_cache is not None:
+            A_img = self.resize_cache.get(A_path, self.grayscale_A, loader=lambda path: self.load_image(path, allow_tensor=False))
+            B_img = self.resize_cache.get(B_path, self.grayscale_B, loader=lambda path: self.load_image(path, allow_tensor=False))
+        else:
+            A_img = self.load_image(A_path)
+            B_img = self.load_image(B_path)
         # apply image transformation
         A = self.transform_A(A_img)
         B = self.transform_B(B_img)
 
         return {'A': A, 'B': B, 'A_paths': A_path, 'B_paths': B_path}
 
+    def get_domain_sizes(self):
+        return self.A_size, self.B_size
+
+    def get_shape_keys(self):
+        """Return the output shape of every data point; B images are drawn to match it (see <__getitem__>)."""
+        return [self.A_shapes[index % self.A_size] for index in range(len(self))]
+
     def __len__(self):
         """Return the total number of images in the dataset.
 
@@ -0,0 +1,40 @@
+"""Pack image directories into memory-mapped shard files for '--dataset_mode packed'.
+
+Example:
+    python datasets/pack_dataset.py --dataroot ./datasets/maps
+writes ./datasets/maps/packed/{trainA,trainB,testA,testB}/ with shard files and an offset index.
+For aligned data, pass '--phases train test'.
+"""
+import os
+import sys
+import argparse
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data.packed_dataset import pack_image_folder  # noqa: E402
+
+
+parser = argparse.ArgumentParser('pack image directories into shard files')
+parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders trainA, trainB, testA, testB or train, test)')
+parser.add_argument('--packed_root', type=str, default='', help='output directory; [dataroot]/packed by default')
+parser.add_argument('--phases', nargs='+', default=['trainA', 'trainB', 'testA', 'testB'], help='subfolders of dataroot to pack; missing ones are skipped')
+parser.add_argument('--shard_size', type=int, default=1024, help='maximum size of one shard file in MB')
+parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='maximum number of images packed per subfolder')
+parser.add_argument('--no_multiprocessing', action='store_true', help='if specified, decode the images in a single process')
+args = parser.parse_args()
+
+for arg in vars(args):
+    print('[%s] = ' % arg, getattr(args, arg))
+
+packed_root = args.packed_root or os.path.join(args.dataroot, 'packed')
+pool = None if args.no_multiprocessing else Pool()
+for phase in args.phases:
+    src_dir = os.path.join(args.dataroot, phase)
+    if not os.path.isdir(src_dir):
+        print('skip %s: not a directory' % src_dir)
+        continue
+    num_imgs = pack_image_folder(src_dir, os.path.join(packed_root, phase), args.shard_size << 20, args.max_dataset_size, pool)
+    print('phase = %s, number of packed images = %d' % (phase, num_imgs))
+if pool is not None:
+    pool.close()
+    pool.join()
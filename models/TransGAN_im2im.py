@@ -1,6 +1,8 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import math
+from torch.utils.checkpoint import checkpoint
 
 from models.ViT_helper import DropPath, to_2tuple, trunc_normal_
 from models.diff_aug import DiffAugment
@@ -46,22 +48,143 @@ class Mlp(nn.Module):
         return x
 
 
-def get_attn_mask(N, w):
-    mask = torch.zeros(1, 1, N, N).cuda()
-    for i in range(N):
-        if i <= w:
-            mask[:, :, i, 0:i+w+1] = 1
-        elif N - i <= w:
-            mask[:, :, i, i-w:N] = 1
+_attn_masks = {}  # (N, w, device, dtype) -> mask; shared by all the attention blocks
+
+
+def get_attn_mask(N, w, device='cpu', dtype=torch.float32):
+    """Return the [1, 1, N, N] band mask that lets token i attend to the tokens j with |i - j| <= w.
+
+    The masks are built lazily with one vectorized comparison and cached per (N, w, device, dtype),
+    so blocks of the same size share them and they are never copied between devices.
+    """
+    device = torch.device(device)
+    key = (N, w, device, dtype)
+    if key not in _attn_masks:
+        index = torch.arange(N, device=device)
+        _attn_masks[key] = ((index[:, None] - index[None, :]).abs() <= w).to(dtype)[None, None]
+    return _attn_masks[key]
+
+
+def local_attention(q, k, v, w, scale, attn_drop):
+    """Attention restricted to the band |i - j| <= w, the same as masking with <get_attn_mask>(N, w).
+
+    Only the 2w+1 in-band scores of every query are computed, so the cost is linear in the number of tokens N.
+
+    Parameters:
+        q, k, v (tensor)      -- queries, keys and values of shape [B, heads, N, head_dim]
+        w (int)               -- the half width of the band
+        scale (float)         -- the scale of the scores
+        attn_drop (nn.Module) -- the dropout applied to the attention weights
+    """
+    N = q.size(2)
+    # windows of the keys and values around every token: [B, heads, N, head_dim, 2w+1]
+    k = F.pad(k, (0, 0, w, w)).unfold(2, 2 * w + 1, 1)
+    v = F.pad(v, (0, 0, w, w)).unfold(2, 2 * w + 1, 1)
+    attn = (torch.einsum('bhnd,bhndk->bhnk', q, k) * scale).float()
+    pos = torch.arange(N, device=q.device)[:, None] + torch.arange(-w, w + 1, device=q.device)
+    attn = attn.masked_fill((pos < 0) | (pos >= N), -1e9)  # the padding outside the sequence
+    attn = attn_drop(attn.softmax(dim=-1).to(v.dtype))
+    return torch.einsum('bhnk,bhndk->bhnd', attn, v)
+
+
+def chunked_attention(q, k, v, chunk_size, scale, attn_drop, mask=None):
+    """Exact attention computed over blocks of chunk_size queries and keys, with an online softmax.
+
+    The scores of one block of queries are accumulated block of keys by block of keys, rescaling the partial sums
+    with the running maximum, so at most chunk_size x chunk_size scores exist at a time. When gradients are needed,
+    every block of queries is checkpointed and recomputed in the backward pass, so that the peak memory stays linear
+    in the number of tokens N instead of N x N.
+
+    Parameters:
+        q, k, v (tensor)      -- queries, keys and values of shape [B, heads, N, head_dim]
+        chunk_size (int)      -- the number of queries and keys per block
+        scale (float)         -- the scale of the scores
+        attn_drop (nn.Module) -- the dropout applied to the attention weights
+        mask (tensor)         -- an optional boolean [1, 1, N, N] mask of the allowed scores
+
+    The softmax statistics are kept in fp32, also under autocast.
+    """
+    N = q.size(2)
+
+    def attend(q_chunk, start):
+        shape = q_chunk.shape[:-1] + (1,)
+        m = q_chunk.new_full(shape, float('-inf'), dtype=torch.float32)  # running maximum of the scores
+        l = q_chunk.new_zeros(shape, dtype=torch.float32)                 # running sum of exp(scores - m)
+        acc = torch.zeros_like(q_chunk, dtype=torch.float32)              # running sum of exp(scores - m) @ v
+        for k_start in range(0, N, chunk_size):
+            attn = ((q_chunk @ k[:, :, k_start:k_start + chunk_size].transpose(-2, -1)) * scale).float()
+            if mask is not None:
+                attn = attn.masked_fill(~mask[..., start:start + q_chunk.size(2), k_start:k_start + chunk_size], -1e9)
+            m_new = torch.maximum(m, attn.amax(dim=-1, keepdim=True))
+            p = torch.exp(attn - m_new)
+            correction = torch.exp(m - m_new)
+            l = l * correction + p.sum(dim=-1, keepdim=True)
+            # dropout scales the weights elementwise, so it can be applied before the normalization by l
+            acc = acc * correction + attn_drop(p).to(v.dtype) @ v[:, :, k_start:k_start + chunk_size]
+            m = m_new
+        return (acc / l).to(q.dtype)
+
+    outputs = []
+    for start in range(0, N, chunk_size):
+        q_chunk = q[:, :, start:start + chunk_size]
+        if torch.is_grad_enabled() and q.requires_grad:
+            outputs.append(checkpoint(attend, q_chunk, start, use_reentrant=False))
         else:
-            mask[:, :, i, i:i+w+1] = 1
-            mask[:, :, i, i-w:i] = 1
-    return mask
+            outputs.append(attend(q_chunk, start))
+    return torch.cat(outputs, dim=2)
+
+
+def axial_attention(q, k, v, scale, attn_drop):
+    """Attention along the rows and the columns of a square token grid, in O(N * sqrt(N)).
+
+    The first half of the heads attends within the row of every token, the second half within its column,
+    so the layer keeps the weights of dense attention and two stacked layers connect every pair of tokens.
+
+    Parameters:
+        q, k, v (tensor)      -- queries, keys and values of shape [B, heads, N, head_dim], N = H * W in row-major order
+        scale (float)         -- the scale of the scores
+        attn_drop (nn.Module) -- the dropout applied to the attention weights
+    """
+    B, heads, N, head_dim = q.shape
+    H = W = int(math.isqrt(N))
+    assert H * W == N, 'axial attention needs a square token grid, got %d tokens' % N
+    assert heads >= 2, 'axial attention needs at least two heads'
+    q, k, v = (t.reshape(B, heads, H, W, head_dim) for t in (q, k, v))
+    row, col = heads // 2, slice(heads // 2, heads)
+    q_rows, k_rows, v_rows = q[:, :row], k[:, :row], v[:, :row]
+    q_cols, k_cols, v_cols = (t[:, col].transpose(2, 3) for t in (q, k, v))
+    x = []
+    for q_axis, k_axis, v_axis in ((q_rows, k_rows, v_rows), (q_cols, k_cols, v_cols)):
+        attn = attn_drop(((q_axis @ k_axis.transpose(-2, -1)) * scale).float().softmax(dim=-1).to(v_axis.dtype))
+        x.append(attn @ v_axis)
+    return torch.cat([x[0], x[1].transpose(2, 3)], dim=1).reshape(B, heads, N, head_dim)
+
+
+def linear_attention(q, k, v):
+    """Kernelized linear attention (Katharopoulos et al. 2020) with the feature map elu(x) + 1, in O(N).
+
+    Parameters:
+        q, k, v (tensor) -- queries, keys and values of shape [B, heads, N, head_dim]
+    """
+    dtype = v.dtype
+    q, k, v = F.elu(q.float()) + 1, F.elu(k.float()) + 1, v.float()  # the sums over N would overflow fp16
+    kv = torch.einsum('bhnd,bhne->bhde', k, v)
+    normalizer = 1. / torch.einsum('bhnd,bhd->bhn', q, k.sum(dim=2)).unsqueeze(-1)
+    return (torch.einsum('bhnd,bhde->bhne', q, kv) * normalizer).to(dtype)
 
 
 class Attention(nn.Module):
-    def __init__(self, dim, num_heads=8, qkv_bias=False, qk_scale=None, attn_drop=0., proj_drop=0., is_mask=0):
+    def __init__(self, dim, num_heads=8, qkv_bias=False, qk_scale=None, attn_drop=0., proj_drop=0., is_mask=0, attn_backend='math',
+                 local_attn=False, chunk_size=0, attn_type='dense'):
         super().__init__()
+        # math: explicit NxN scores and softmax; sdpa: torch.nn.functional.scaled_dot_product_attention (torch >= 2.1)
+        assert attn_backend == 'math' or torch.__version__ >= '2.1', 'attn_backend [sdpa] requires torch >= 2.1 (the scale argument of scaled_dot_product_attention)'
+        self.attn_backend = attn_backend
+        self.local_attn = local_attn  # compute only the in-band scores while the mask is on; see <local_attention>
+        self.chunk_size = chunk_size  # > 0: blocks of queries and keys with an online softmax; see <chunked_attention>
+        # dense: every pair of tokens; axial | linear: sub-quadratic approximations, see <axial_attention> and <linear_attention>
+        assert attn_type in ('dense', 'axial', 'linear'), 'attention type [%s] is not recognized' % attn_type
+        self.attn_type = attn_type
         self.num_heads = num_heads
         head_dim = dim // num_heads
         # NOTE scale factor was wrong in my original version, can set manually to be compat with prev weights
@@ -71,39 +194,56 @@ class Attention(nn.Module):
         self.attn_drop = nn.Dropout(attn_drop)
         self.proj = nn.Linear(dim, dim)
         self.proj_drop = nn.Dropout(proj_drop)
-        self.mat = matmul()
+        if attn_backend == 'math' and attn_type == 'dense':  # the explicit attention; local and chunked fall back to it
+            self.mat = matmul()
         self.is_mask = is_mask
         self.remove_mask = False
-        self.mask_4 = get_attn_mask(is_mask, 4)
-        self.mask_5 = get_attn_mask(is_mask, 5)
-        self.mask_6 = get_attn_mask(is_mask, 6)
-        self.mask_7 = get_attn_mask(is_mask, 7)
-        self.mask_8 = get_attn_mask(is_mask, 8)
-        self.mask_10 = get_attn_mask(is_mask, 10)
+
+    def get_window(self, epoch):
+        """Return the half width of the attention band of the current epoch, or None when every token attends to all the others."""
+        if not self.is_mask or epoch >= 60:
+            return None
+        if epoch < 22:
+            return 4
+        elif epoch < 32:
+            return 6
+        elif epoch < 42:
+            return 8
+        return 10
+
+    def get_mask(self, epoch, N, device):
+        """Return the boolean band mask of the current epoch, or None when every token attends to all the others."""
+        w = self.get_window(epoch)
+        return None if w is None else get_attn_mask(N, w, device, torch.bool)
 
     def forward(self, x, epoch):
         B, N, C = x.shape
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]   # make torchscript happy (cannot use tensor as tuple)
-
-        attn = (self.mat(q, k.transpose(-2, -1))) * self.scale
-        if self.is_mask:
-            if epoch < 60:
-                if epoch < 22:
-                    mask = self.mask_4
-                elif epoch < 32:
-                    mask = self.mask_6
-                elif epoch < 42:
-                    mask = self.mask_8
-                else:
-                    mask = self.mask_10
-                attn = attn.masked_fill(mask.to(attn.get_device()) == 0, -1e9)
-            else:
-                pass
-        attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
-
-        x = self.mat(attn, v).transpose(1, 2).reshape(B, N, C)
+        w = self.get_window(epoch)
+
+        if self.attn_type == 'axial':  # the band mask is not applied: the image is attended as a whole from the start
+            x = axial_attention(q, k, v, self.scale, self.attn_drop)
+        elif self.attn_type == 'linear':
+            x = linear_attention(q, k, v)
+        elif self.local_attn and w is not None:  # linear in N; falls back to dense attention once the mask is removed
+            x = local_attention(q, k, v, w, self.scale, self.attn_drop)
+        elif 0 < self.chunk_size < N:  # exact, with memory linear in N; also bounds the memory with attn_backend sdpa
+            x = chunked_attention(q, k, v, self.chunk_size, self.scale, self.attn_drop, self.get_mask(epoch, N, q.device))
+        elif self.attn_backend == 'sdpa':  # fused kernel; the band mask is passed as a boolean attention mask
+            x = F.scaled_dot_product_attention(q, k, v, attn_mask=self.get_mask(epoch, N, q.device),
+                                               dropout_p=self.attn_drop.p if self.training else 0., scale=self.scale)
+        else:
+            attn = (self.mat(q, k.transpose(-2, -1))) * self.scale
+            attn = attn.float()  # the masking and the softmax run in fp32, also under autocast
+            mask = self.get_mask(epoch, N, q.device)
+            if mask is not None:
+                attn = attn.masked_fill(~mask, -1e9)
+            attn = attn.softmax(dim=-1).to(v.dtype)
+            attn = self.attn_drop(attn)
+            x = self.mat(attn, v)
+
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -112,18 +252,25 @@ class Attention(nn.Module):
 class Block(nn.Module):
 
     def __init__(self, dim, num_heads, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop=0., attn_drop=0.,
-                 drop_path=0., act_layer=gelu, norm_layer=nn.LayerNorm, is_mask=0):
+                 drop_path=0., act_layer=gelu, norm_layer=nn.LayerNorm, is_mask=0, attn_backend='math', local_attn=False, chunk_size=0, attn_type='dense'):
         super().__init__()
         self.norm1 = norm_layer(dim)
         self.attn = Attention(
-            dim, num_heads=num_heads, qkv_bias=qkv_bias, qk_scale=qk_scale, attn_drop=attn_drop, proj_drop=drop, is_mask=is_mask)
+            dim, num_heads=num_heads, qkv_bias=qkv_bias, qk_scale=qk_scale, attn_drop=attn_drop, proj_drop=drop, is_mask=is_mask,
+            attn_backend=attn_backend, local_attn=local_attn, chunk_size=chunk_size, attn_type=attn_type)
         # NOTE: drop path for stochastic depth, we shall see if this is better than dropout here
         self.drop_path = DropPath(drop_path) if drop_path > 0. else nn.Identity()
         self.norm2 = norm_layer(dim)
         mlp_hidden_dim = int(dim * mlp_ratio)
         self.mlp = Mlp(in_features=dim, hidden_features=mlp_hidden_dim, act_layer=act_layer, drop=drop)
+        self.use_checkpoint = False  # recompute the activations in the backward pass; see networks.set_grad_checkpointing
 
     def forward(self, x, epoch):
+        if self.use_checkpoint and torch.is_grad_enabled():
+            return checkpoint(self.forward_block, x, epoch, use_reentrant=False)
+        return self.forward_block(x, epoch)
+
+    def forward_block(self, x, epoch):
         x = x + self.drop_path(self.attn(self.norm1(x), epoch))
         x = x + self.drop_path(self.mlp(self.norm2(x)))
         return x
@@ -141,7 +288,7 @@ def pixel_upsample(x, H, W):
 
 
 class GeneratorCeleba(nn.Module):
-    def __init__(self, args, img_size=224, patch_size=16, in_chans=3, num_classes=10, embed_dim=384, depth=5,
+    def __init__(self, args, img_size=224, patch_size=16, in_chans=3, out_chans=3, num_classes=10, embed_dim=384, depth=5,
                  num_heads=4, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop_rate=0., attn_drop_rate=0.,
                  drop_path_rate=0., hybrid_backbone=None, norm_layer=nn.LayerNorm):
         super().__init__()
@@ -151,7 +298,7 @@ class GeneratorCeleba(nn.Module):
         self.embed_dim = embed_dim = args.gf_dim
         
         patch_size = args.patch_size
-        self.patch_embed = nn.Conv2d(3, embed_dim, kernel_size=patch_size, stride=patch_size, padding=0)
+        self.patch_embed = nn.Conv2d(in_chans, embed_dim, kernel_size=patch_size, stride=patch_size, padding=0)
         num_patches = (args.img_size // patch_size)**2
         self.proj_1 = nn.Linear(num_patches, num_patches // 2)
         self.proj_2 = nn.Linear(num_patches // 2, num_patches // 4)
@@ -161,54 +308,53 @@ class GeneratorCeleba(nn.Module):
         self.pos_embed_2 = nn.Parameter(torch.zeros(1, (self.bottom_width*2)**2, embed_dim//4))
         self.pos_embed_3 = nn.Parameter(torch.zeros(1, (self.bottom_width*4)**2, embed_dim//16))
         self.pos_embed_4 = nn.Parameter(torch.zeros(1, (self.bottom_width*8)**2, embed_dim//64))
-        self.pos_embed = [
-            self.pos_embed_1,
-            self.pos_embed_2,
-            self.pos_embed_3,
-            self.pos_embed_4
-        ]
         is_mask = True
+        attn_backend = args.attn_backend
+        local_attn = args.local_attn
+        # stage 0 is self.blocks, stage i the i-th upsample stage; stages without a chunk size attend densely
+        stage_attn = [dict(chunk_size=args.attn_chunk_sizes[stage] if stage < len(args.attn_chunk_sizes) else 0,
+                           attn_type=args.upsample_attn if stage > 0 else 'dense') for stage in range(4)]
         dpr = [x.item() for x in torch.linspace(0, drop_path_rate, depth)]  # stochastic depth decay rule
         self.blocks = nn.ModuleList([
                 Block(
                     dim=embed_dim, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                    drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[i], norm_layer=norm_layer)
+                    drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[i], norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, **stage_attn[0])
             for i in range(depth)])
         self.upsample_blocks = nn.ModuleList([
                  nn.ModuleList([
                     Block(
                         dim=embed_dim//4, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer),
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, **stage_attn[1]),
                     Block(
                         dim=embed_dim//4, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=0),
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=0, **stage_attn[1]),
                     Block(
                         dim=embed_dim//4, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=0)
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=0, **stage_attn[1])
                  ]
                 ),
                  nn.ModuleList([
                     Block(
                         dim=embed_dim//16, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer),
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, **stage_attn[2]),
                     Block(
                         dim=embed_dim//16, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=0),
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=0, **stage_attn[2]),
                     Block(
                         dim=embed_dim//16, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=0)
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=0, **stage_attn[2])
                  ]
                 ),
                 nn.ModuleList([
                     # Block(
                     #     dim=embed_dim//16, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                    #     drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer),
+                    #     drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn),
                     Block(
                         dim=embed_dim//64, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=0),
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=0, **stage_attn[3]),
                     Block(
                         dim=embed_dim//64, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=(self.bottom_width*8)**2)
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=(self.bottom_width*8)**2, **stage_attn[3])
                  ]
                 )
                 ])
@@ -218,11 +364,15 @@ class GeneratorCeleba(nn.Module):
         self.deconv = nn.Sequential(
             # nn.BatchNorm2d(self.embed_dim),
             # nn.ReLU(),
-            nn.Conv2d(self.embed_dim//256, 3, 1, 1, 0)
+            nn.Conv2d(self.embed_dim//256, out_chans, 1, 1, 0)
         )
 
         self.act = nn.Tanh()
 
+    @property
+    def pos_embed(self):
+        return [self.pos_embed_1, self.pos_embed_2, self.pos_embed_3, self.pos_embed_4]
+
     def set_arch(self, x, cur_stage):
         pass
 
@@ -232,7 +382,7 @@ class GeneratorCeleba(nn.Module):
         x = self.proj_2(x)
         x = self.proj_3(x).permute(0, 2, 1)
 
-        x = x + self.pos_embed[0].to(x.get_device())
+        x = x + self.pos_embed[0]
         B = x.size()
         H, W = self.bottom_width, self.bottom_width
         for index, blk in enumerate(self.blocks):
@@ -241,7 +391,7 @@ class GeneratorCeleba(nn.Module):
             # x = x.permute(0,2,1)
             # x = x.view(-1, self.embed_dim, H, W)
             x, H, W = pixel_upsample(x, H, W)
-            x = x + self.pos_embed[index+1].to(x.get_device())
+            x = x + self.pos_embed[index+1]
             for b in blk:
                 x = b(x, epoch)
 
@@ -252,7 +402,7 @@ class GeneratorCeleba(nn.Module):
 
 
 class GeneratorCifar(nn.Module):
-    def __init__(self, args, img_size=224, patch_size=4, in_chans=3, num_classes=10, embed_dim=384, depth=5,
+    def __init__(self, args, img_size=224, patch_size=4, in_chans=3, out_chans=3, num_classes=10, embed_dim=384, depth=5,
                  num_heads=4, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop_rate=0., attn_drop_rate=0.,
                  drop_path_rate=0., hybrid_backbone=None, norm_layer=nn.LayerNorm):
         super().__init__()
@@ -263,7 +413,7 @@ class GeneratorCifar(nn.Module):
         #self.l1 = nn.Linear(args.latent_dim, (self.bottom_width ** 2) * self.embed_dim)
         
         patch_size = args.patch_size
-        self.patch_embed = nn.Conv2d(3, embed_dim, kernel_size=patch_size, stride=patch_size, padding=0)
+        self.patch_embed = nn.Conv2d(in_chans, embed_dim, kernel_size=patch_size, stride=patch_size, padding=0)
         num_patches = (args.img_size // patch_size)**2
         self.proj_1 = nn.Linear(num_patches, num_patches // 2)
         self.proj_2 = nn.Linear(num_patches // 2, self.bottom_width ** 2)
@@ -271,41 +421,41 @@ class GeneratorCifar(nn.Module):
         self.pos_embed_1 = nn.Parameter(torch.zeros(1, self.bottom_width**2, embed_dim))
         self.pos_embed_2 = nn.Parameter(torch.zeros(1, (self.bottom_width*2)**2, embed_dim//4))
         self.pos_embed_3 = nn.Parameter(torch.zeros(1, (self.bottom_width*4)**2, embed_dim//16))
-        self.pos_embed = [
-            self.pos_embed_1,
-            self.pos_embed_2,
-            self.pos_embed_3
-        ]
         is_mask = True
+        attn_backend = args.attn_backend
+        local_attn = args.local_attn
+        # stage 0 is self.blocks, stage i the i-th upsample stage; stages without a chunk size attend densely
+        stage_attn = [dict(chunk_size=args.attn_chunk_sizes[stage] if stage < len(args.attn_chunk_sizes) else 0,
+                           attn_type=args.upsample_attn if stage > 0 else 'dense') for stage in range(3)]
         dpr = [x.item() for x in torch.linspace(0, drop_path_rate, depth)]  # stochastic depth decay rule
         self.blocks = nn.ModuleList([
                 Block(
                     dim=embed_dim, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                    drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[i], norm_layer=norm_layer)
+                    drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[i], norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, **stage_attn[0])
             for i in range(depth)])
         self.upsample_blocks = nn.ModuleList([
                  nn.ModuleList([
                     Block(
                         dim=embed_dim//4, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=0),
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=0, **stage_attn[1]),
                     Block(
                         dim=embed_dim//4, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=0),
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=0, **stage_attn[1]),
                     Block(
                         dim=embed_dim//4, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=0),
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=0, **stage_attn[1]),
                     Block(
                         dim=embed_dim//4, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=0)
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=0, **stage_attn[1])
                  ]
                 ),
                  nn.ModuleList([
                     Block(
                         dim=embed_dim//16, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=0),
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=0, **stage_attn[2]),
                     Block(
                         dim=embed_dim//16, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, is_mask=(self.bottom_width*4)**2)
+                        drop=drop_rate, attn_drop=attn_drop_rate, drop_path=0, norm_layer=norm_layer, attn_backend=attn_backend, local_attn=local_attn, is_mask=(self.bottom_width*4)**2, **stage_attn[2])
                  ]
                 )
                 ])
@@ -313,11 +463,16 @@ class GeneratorCifar(nn.Module):
             trunc_normal_(self.pos_embed[i], std=.02)
         
         self.deconv = nn.Sequential(
-            nn.Conv2d(self.embed_dim//64, 3, 1, 1, 0)
+            nn.Conv2d(self.embed_dim//64, out_chans, 1, 1, 0)
         )
 
         self.act = nn.Tanh()
 
+    @property
+    def pos_embed(self):
+        # a property rather than a list attribute, so that it follows .to() and the DataParallel replicas
+        return [self.pos_embed_1, self.pos_embed_2, self.pos_embed_3]
+
     def set_arch(self, x, cur_stage):
         pass
 
@@ -327,7 +482,7 @@ class GeneratorCifar(nn.Module):
         x = self.proj_1(x)
         x = self.proj_2(x).permute(0, 2, 1)
         
-        x = x + self.pos_embed[0].to(x.get_device())
+        x = x + self.pos_embed[0]
         B = x.size()
         H, W = self.bottom_width, self.bottom_width
         for index, blk in enumerate(self.blocks):
@@ -335,7 +490,7 @@ class GeneratorCifar(nn.Module):
         for index, blk in enumerate(self.upsample_blocks):
             
             x, H, W = pixel_upsample(x, H, W)
-            x = x + self.pos_embed[index+1].to(x.get_device())
+            x = x + self.pos_embed[index+1]
             for b in blk:
                 x = b(x, epoch)
         x, H, W = pixel_upsample(x, H, W) # bs, HxW, embed_dim // 64
@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import math
 
 from models.ViT_helper import DropPath, to_2tuple, trunc_normal_
@@ -47,8 +48,11 @@ class Mlp(nn.Module):
 
 
 class Attention(nn.Module):
-    def __init__(self, dim, num_heads=8, qkv_bias=False, qk_scale=None, attn_drop=0., proj_drop=0.):
+    def __init__(self, dim, num_heads=8, qkv_bias=False, qk_scale=None, attn_drop=0., proj_drop=0., attn_backend='math'):
         super().__init__()
+        # math: explicit NxN scores and softmax; sdpa: torch.nn.functional.scaled_dot_product_attention (torch >= 2.1)
+        assert attn_backend == 'math' or torch.__version__ >= '2.1', 'attn_backend [sdpa] requires torch >= 2.1 (the scale argument of scaled_dot_product_attention)'
+        self.attn_backend = attn_backend
         self.num_heads = num_heads
         head_dim = dim // num_heads
         # NOTE scale factor was wrong in my original version, can set manually to be compat with prev weights
@@ -58,21 +62,77 @@ class Attention(nn.Module):
         self.attn_drop = nn.Dropout(attn_drop)
         self.proj = nn.Linear(dim, dim)
         self.proj_drop = nn.Dropout(proj_drop)
-        self.mat = matmul()
+        if attn_backend == 'math':  # only the explicit attention uses it
+            self.mat = matmul()
 
-    def forward(self, x):
+    def forward(self, x, size=None, return_keys=False):
+        """Attend over the tokens.
+
+        Parameters:
+            x (tensor)         -- the tokens [B, N, C]
+            size (tensor)      -- the number of patches merged into every token [B, N, 1], see <merge_tokens>; None: 1
+            return_keys (bool) -- if the keys [B, heads, N, head_dim] are also returned
+        """
         B, N, C = x.shape
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]   # make torchscript happy (cannot use tensor as tuple)
+        # proportional attention: a merged token counts as often as the patches it contains
+        bias = None if size is None else size.log()[:, None, None, :, 0].to(q.dtype)
 
-        attn = (self.mat(q, k.transpose(-2, -1))) * self.scale
-        attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
-
-        x = self.mat(attn, v).transpose(1, 2).reshape(B, N, C)
+        if self.attn_backend == 'sdpa':  # fused kernel
+            x = F.scaled_dot_product_attention(q, k, v, attn_mask=bias, dropout_p=self.attn_drop.p if self.training else 0., scale=self.scale)
+        else:
+            attn = (self.mat(q, k.transpose(-2, -1))) * self.scale
+            if bias is not None:
+                attn = attn + bias
+            attn = attn.float().softmax(dim=-1).to(v.dtype)  # fp32 softmax, also under autocast
+            attn = self.attn_drop(attn)
+            x = self.mat(attn, v)
+
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
-        return x
+        return (x, k) if return_keys else x
+
+
+def merge_tokens(x, size, metric, r):
+    """Merge the r most similar pairs of patch tokens by bipartite soft matching (ToMe, Bolya et al. 2023).
+
+    The tokens are split into two alternating sets; each token of the first set is matched to its most similar token
+    of the second set by the cosine similarity of <metric>, and the r best matches are averaged, weighted by their sizes.
+    The class token (index 0) is never merged and stays first.
+
+    Parameters:
+        x (tensor)      -- the tokens [B, N, C]
+        size (tensor)   -- the number of patches in every token [B, N, 1]
+        metric (tensor) -- the similarity features of the tokens [B, N, D], e.g. the keys averaged over the heads
+        r (int)         -- the number of tokens to remove
+
+    Returns the merged tokens [B, N - r, C] and their sizes [B, N - r, 1].
+    """
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = metric[:, ::2], metric[:, 1::2]
+        r = min(r, a.size(1) - 1)
+        scores = a @ b.transpose(-1, -2)
+        scores[:, 0] = -math.inf  # the class token
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unm_idx = edge_idx[:, r:].sort(dim=1)[0]  # unmerged tokens of the first set, in their order
+        src_idx = edge_idx[:, :r]
+        dst_idx = node_idx[..., None].gather(dim=1, index=src_idx)
+
+    def merge(x):
+        src, dst = x[:, ::2], x[:, 1::2]
+        B, n, C = src.shape
+        unm = src.gather(dim=1, index=unm_idx.expand(B, n - r, C))
+        src = src.gather(dim=1, index=src_idx.expand(B, r, C))
+        dst = dst.scatter_reduce(1, dst_idx.expand(B, r, C), src, reduce='sum')
+        return torch.cat([unm, dst], dim=1)
+
+    x = merge(x * size)
+    size = merge(size)
+    return x / size, size
 
 
 class Block(nn.Module):
@@ -118,11 +178,6 @@ class Generator(nn.Module):
         self.pos_embed_1 = nn.Parameter(torch.zeros(1, self.bottom_width**2, embed_dim))
         self.pos_embed_2 = nn.Parameter(torch.zeros(1, (self.bottom_width*2)**2, embed_dim//4))
         self.pos_embed_3 = nn.Parameter(torch.zeros(1, (self.bottom_width*4)**2, embed_dim//16))
-        self.pos_embed = [
-            self.pos_embed_1,
-            self.pos_embed_2,
-            self.pos_embed_3
-        ]
         dpr = [x.item() for x in torch.linspace(0, drop_path_rate, depth)]  # stochastic depth decay rule
         self.blocks = nn.ModuleList([
                 Block(
@@ -171,12 +226,16 @@ class Generator(nn.Module):
             # nn.Tanh()
         )
 
+    @property
+    def pos_embed(self):
+        return [self.pos_embed_1, self.pos_embed_2, self.pos_embed_3]
+
     def set_arch(self, x, cur_stage):
         pass
 
     def forward(self, z, epoch=100):
         x = self.l1(z).view(-1, self.bottom_width ** 2, self.embed_dim)
-        x = x + self.pos_embed[0].to(x.get_device())
+        x = x + self.pos_embed[0]
         B = x.size()
         H, W = self.bottom_width, self.bottom_width
         for index, blk in enumerate(self.blocks):
@@ -185,7 +244,7 @@ class Generator(nn.Module):
             # x = x.permute(0,2,1)
             # x = x.view(-1, self.embed_dim, H, W)
             x, H, W = pixel_upsample(x, H, W)
-            x = x + self.pos_embed[index+1].to(x.get_device())
+            x = x + self.pos_embed[index+1]
             x = blk(x)
             # _, _, H, W = x.size()
             # x = x.view(-1, self.embed_dim, H*W)
@@ -201,11 +260,12 @@ def _downsample(x):
 class Block(nn.Module):
 
     def __init__(self, dim, num_heads, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop=0., attn_drop=0.,
-                 drop_path=0., act_layer=gelu, norm_layer=nn.LayerNorm):
+                 drop_path=0., act_layer=gelu, norm_layer=nn.LayerNorm, attn_backend='math'):
         super().__init__()
         self.norm1 = norm_layer(dim)
         self.attn = Attention(
-            dim, num_heads=num_heads, qkv_bias=qkv_bias, qk_scale=qk_scale, attn_drop=attn_drop, proj_drop=drop)
+            dim, num_heads=num_heads, qkv_bias=qkv_bias, qk_scale=qk_scale, attn_drop=attn_drop, proj_drop=drop,
+            attn_backend=attn_backend)
         # NOTE: drop path for stochastic depth, we shall see if this is better than dropout here
         self.drop_path = DropPath(drop_path) if drop_path > 0. else nn.Identity()
         self.norm2 = norm_layer(dim)
@@ -217,6 +277,14 @@ class Block(nn.Module):
         x = x + self.drop_path(self.mlp(self.norm2(x)))
         return x
 
+    def forward_merge(self, x, size, r):
+        """Like <forward>, but merge r patch tokens between the attention and the MLP; see <merge_tokens>."""
+        x_attn, k = self.attn(self.norm1(x), size, return_keys=True)
+        x = x + self.drop_path(x_attn)
+        x, size = merge_tokens(x, size, k.mean(dim=1), r)
+        x = x + self.drop_path(self.mlp(self.norm2(x)))
+        return x, size
+
 
 class PatchEmbed(nn.Module):
     """ Image to Patch Embedding
@@ -292,7 +360,7 @@ class Discriminator(nn.Module):
             self.patch_embed = HybridEmbed(
                 hybrid_backbone, img_size=img_size, in_chans=in_chans, embed_dim=embed_dim)
         else:
-            self.patch_embed = nn.Conv2d(3, embed_dim, kernel_size=patch_size, stride=patch_size, padding=0)
+            self.patch_embed = nn.Conv2d(in_chans, embed_dim, kernel_size=patch_size, stride=patch_size, padding=0)
         num_patches = (args.img_size // patch_size)**2
 
         self.cls_token = nn.Parameter(torch.zeros(1, 1, embed_dim))
@@ -303,7 +371,7 @@ class Discriminator(nn.Module):
         self.blocks = nn.ModuleList([
             Block(
                 dim=embed_dim, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[i], norm_layer=norm_layer)
+                drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[i], norm_layer=norm_layer, attn_backend=args.attn_backend)
             for i in range(depth)])
         self.norm = norm_layer(embed_dim)
 
@@ -348,8 +416,13 @@ class Discriminator(nn.Module):
         x = torch.cat((cls_tokens, x), dim=1)
         x = x + self.pos_embed
         x = self.pos_drop(x)
-        for blk in self.blocks:
-            x = blk(x)
+        if self.args.token_merge > 0:  # every block merges this fraction of its patch tokens
+            size = x.new_ones(B, x.size(1), 1)
+            for blk in self.blocks:
+                x, size = blk.forward_merge(x, size, int(self.args.token_merge * (x.size(1) - 1)))
+        else:
+            for blk in self.blocks:
+                x = blk(x)
 
         x = self.norm(x)
         return x[:,0]
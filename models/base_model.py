@@ -1,5 +1,6 @@
 import os
 import torch
+import contextlib
 from collections import OrderedDict
 from abc import ABC, abstractmethod
 from . import networks
@@ -34,7 +35,13 @@ class BaseModel(ABC):
         self.isTrain = opt.isTrain
         self.device = torch.device('cuda:{}'.format(self.gpu_ids[0])) if self.gpu_ids else torch.device('cpu')  # get device name: CPU or GPU
         self.save_dir = os.path.join(opt.checkpoints_dir, opt.name)  # save all the checkpoints to save_dir
-        if opt.preprocess != 'scale_width':  # with [scale_width], input images might have different sizes, which hurts the performance of cudnn.benchmark.
+        # mixed precision: the dtype of autocast, and a loss scaler that only exists for fp16 training
+        self.amp_dtype = {'none': None, 'fp16': torch.float16, 'bf16': torch.bfloat16}[opt.amp]
+        self.scaler = None
+        if opt.amp == 'fp16' and self.isTrain:
+            assert torch.__version__ >= '2.3', '--amp fp16 requires torch >= 2.3 (torch.amp.GradScaler for any device)'
+            self.scaler = torch.amp.GradScaler(self.device.type)
+        if opt.preprocess != 'scale_width' or opt.bucket_by_shape:  # with [scale_width], input images might have different sizes, which hurts the performance of cudnn.benchmark; shape buckets keep their number small.
             torch.backends.cudnn.benchmark = True
         self.loss_names = []
         self.model_names = []
@@ -42,6 +49,7 @@ class BaseModel(ABC):
         self.optimizers = []
         self.image_paths = []
         self.metric = 0  # used for learning rate policy 'plateau'
+        self.loss_window = None  # running loss statistics on the device; see <accumulate_losses>
 
     @staticmethod
     def modify_commandline_options(parser, is_train):
@@ -65,6 +73,42 @@ class BaseModel(ABC):
         """
         pass
 
+    def prepare_image(self, image):
+        """Move a batch of images to self.device.
+
+        uint8 images (see '--uint8_transfer') are converted to float and normalized to [-1, 1] on the device,
+        which moves a quarter of the bytes through the data loader and the host-to-device copy.
+        """
+        image = image.to(self.device, non_blocking=True)
+        if image.dtype == torch.uint8:
+            image = image.float().div_(127.5).sub_(1.0)
+        return image
+
+    def autocast(self):
+        """Return the autocast context of '--amp' for forward passes and losses; it does nothing without '--amp'."""
+        if self.amp_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(self.device.type, dtype=self.amp_dtype)
+
+    def amp_backward(self, loss):
+        """Compute the gradients of <loss>; with '--amp fp16', the loss is scaled so that small fp16 gradients do not underflow."""
+        if self.scaler is None:
+            loss.backward()
+        else:
+            self.scaler.scale(loss).backward()
+
+    def amp_step(self, optimizer):
+        """Update the weights of <optimizer>, skipping the step if '--amp fp16' found inf/nan gradients."""
+        if self.scaler is None:
+            optimizer.step()
+        else:
+            self.scaler.step(optimizer)
+
+    def amp_update(self):
+        """Adjust the loss scale of '--amp fp16'; called once per iteration, after the last <amp_step>."""
+        if self.scaler is not None:
+            self.scaler.update()
+
     @abstractmethod
     def forward(self):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
@@ -83,11 +127,28 @@ class BaseModel(ABC):
         """
         if self.isTrain:
             self.schedulers = [networks.get_scheduler(optimizer, opt) for optimizer in self.optimizers]
+            self.setup_grad_checkpointing(opt)
         if not self.isTrain or opt.continue_train:
             load_suffix = 'iter_%d' % opt.load_iter if opt.load_iter > 0 else opt.epoch
             self.load_networks(load_suffix)
         self.print_networks(opt.verbose)
 
+    def setup_grad_checkpointing(self, opt):
+        """Set up activation checkpointing of the generators by --grad_ckpt_blocks or --grad_ckpt_budget."""
+        if opt.grad_ckpt_budget <= 0 and opt.grad_ckpt_blocks == 0:
+            return
+        for name in self.model_names:
+            if isinstance(name, str) and name.startswith('G'):
+                net = getattr(self, 'net' + name)
+                if opt.grad_ckpt_budget > 0:  # profile a forward pass at the training shape
+                    input_nc = next(m for m in net.modules() if isinstance(m, torch.nn.Conv2d)).in_channels
+                    inputs = [torch.zeros(opt.batch_size, input_nc, opt.crop_size, opt.crop_size, device=self.device)]
+                    if opt.netG == 'transgan':
+                        inputs.append(opt.epoch_count)
+                    networks.fit_grad_checkpointing(net, opt.grad_ckpt_budget * 2 ** 20, *inputs)
+                else:
+                    networks.set_grad_checkpointing(net, opt.grad_ckpt_blocks)
+
     def eval(self):
         """Make models eval mode during test time"""
         for name in self.model_names:
@@ -109,10 +170,11 @@ class BaseModel(ABC):
         It also calls <compute_visuals> to produce additional visualization results
         """
         with torch.no_grad():
-            if epoch:
-                self.forward(epoch)
-            else:
-                self.forward()
+            with self.autocast():
+                if epoch:
+                    self.forward(epoch)
+                else:
+                    self.forward()
             self.compute_visuals()
 
     def compute_visuals(self):
@@ -151,6 +213,40 @@ class BaseModel(ABC):
                 errors_ret[name] = float(getattr(self, 'loss_' + name))  # float(...) works for both scalar tensor and float number
         return errors_ret
 
+    def accumulate_losses(self):
+        """Add the current training losses to the running statistics of the window, without synchronizing with the device.
+
+        The sums are shifted by the first losses of the window, which keeps the variance accurate in float32.
+        """
+        names = [name for name in self.loss_names if isinstance(name, str)]
+        losses = torch.stack([torch.as_tensor(getattr(self, 'loss_' + name), dtype=torch.float32, device=self.device).detach().reshape(())
+                              for name in names])
+        if self.loss_window is None:
+            self.loss_window = {'names': names, 'shift': losses, 'sums': torch.zeros(2, len(names), device=self.device), 'count': 0}
+        delta = losses - self.loss_window['shift']
+        self.loss_window['sums'] += torch.stack([delta, delta * delta])
+        self.loss_window['count'] += 1
+
+    def get_accumulated_losses(self, reset=True):
+        """Return the mean and the variance of every training loss since the last reset, as two OrderedDicts.
+
+        This is the only point where the statistics are copied to the host.
+
+        Parameters:
+            reset (bool) -- if the next <accumulate_losses> starts a new window
+        """
+        means, variances = OrderedDict(), OrderedDict()
+        if self.loss_window is None:  # nothing accumulated: the current losses
+            return self.get_current_losses(), variances
+        window = self.loss_window
+        shift, (sums, sums_sq) = window['shift'].tolist(), (window['sums'] / window['count']).tolist()
+        for name, s, mean, mean_sq in zip(window['names'], shift, sums, sums_sq):
+            means[name] = s + mean
+            variances[name] = max(mean_sq - mean * mean, 0.)
+        if reset:
+            self.loss_window = None
+        return means, variances
+
     def save_networks(self, epoch):
         """Save all the networks to the disk.
 
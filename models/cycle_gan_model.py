@@ -1,6 +1,6 @@
 import torch
 import itertools
-from util.image_pool import ImagePool
+from util.image_pool import ImagePool, TensorImagePool
 from .base_model import BaseModel
 from . import networks
 import os
@@ -38,6 +38,7 @@ class CycleGANModel(BaseModel):
         Dropout is not used in the original CycleGAN paper.
         """
         parser.set_defaults(no_dropout=True)  # default CycleGAN did not use dropout
+        parser.add_argument('--batched_generators', action='store_true', help='if specified, run the independent generator passes (forward, identity and reconstruction) as 3 batched calls instead of 6; identical losses unless the generators use batch normalization or dropout')
         if is_train:
             parser.add_argument('--lambda_A', type=float, default=10.0, help='weight for cycle loss (A -> B -> A)')
             parser.add_argument('--lambda_B', type=float, default=10.0, help='weight for cycle loss (B -> A -> B)')
@@ -72,27 +73,37 @@ class CycleGANModel(BaseModel):
         # The naming is different from those used in the paper.
         # Code (vs. paper): G_A (G), G_B (F), D_A (D_Y), D_B (D_X)
         self.netG_A = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.netG, opt.norm,
-                                        not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids)
+                                        not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids, attn_backend=opt.attn_backend,
+                                        local_attn=opt.local_attn, attn_chunk_sizes=opt.attn_chunk_sizes,
+                                        upsample_attn=opt.upsample_attn, img_size=opt.crop_size, patch_size=opt.patch_size,
+                                        embed_dim=opt.transgan_embed_dim)
         self.netG_B = networks.define_G(opt.output_nc, opt.input_nc, opt.ngf, opt.netG, opt.norm,
-                                        not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids)
+                                        not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids, attn_backend=opt.attn_backend,
+                                        local_attn=opt.local_attn, attn_chunk_sizes=opt.attn_chunk_sizes,
+                                        upsample_attn=opt.upsample_attn, img_size=opt.crop_size, patch_size=opt.patch_size,
+                                        embed_dim=opt.transgan_embed_dim)
 
 
         if self.isTrain:  # define discriminators
             self.netD_A = networks.define_D(opt.output_nc, opt.ndf, opt.netD,
-                                            opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
+                                            opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids, attn_backend=opt.attn_backend,
+                                            img_size=opt.crop_size, patch_size=opt.patch_size, d_depth=opt.d_depth, diff_aug=opt.diff_aug,
+                                            token_merge=opt.token_merge, embed_dim=opt.transgan_d_dim)
             self.netD_B = networks.define_D(opt.input_nc, opt.ndf, opt.netD,
-                                            opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
+                                            opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids, attn_backend=opt.attn_backend,
+                                            img_size=opt.crop_size, patch_size=opt.patch_size, d_depth=opt.d_depth, diff_aug=opt.diff_aug,
+                                            token_merge=opt.token_merge, embed_dim=opt.transgan_d_dim)
         print("Models are defined!!!")
 
         checkpoint_file = os.path.join(opt.checkpoint)
         assert os.path.exists(checkpoint_file)
-        checkpoint = torch.load(checkpoint_file)
+        checkpoint = torch.load(checkpoint_file, map_location=self.device)  # also loads GPU checkpoints on CPU
         gen_new_state_dict = OrderedDict([(k, v) for k, v in checkpoint['gen_state_dict'].items() if not k.startswith('module.deconv.0')])
         dis_new_state_dict = OrderedDict([(k, v) for k, v in checkpoint['dis_state_dict'].items() if not k.startswith('module.pos_embed')])
-        print(self.netG_A.load_state_dict(gen_new_state_dict, strict=False))
-        self.netG_B.load_state_dict(gen_new_state_dict, strict=False)
-        print(self.netD_A.load_state_dict(dis_new_state_dict, strict=False))
-        self.netD_B.load_state_dict(dis_new_state_dict, strict=False)
+        print(networks.load_pretrained_weights(self.netG_A, gen_new_state_dict, opt.allow_partial_checkpoint))
+        networks.load_pretrained_weights(self.netG_B, gen_new_state_dict, opt.allow_partial_checkpoint)
+        print(networks.load_pretrained_weights(self.netD_A, dis_new_state_dict, opt.allow_partial_checkpoint))
+        networks.load_pretrained_weights(self.netD_B, dis_new_state_dict, opt.allow_partial_checkpoint)
         print("Weights are loaded!!!")
 
         print("Training: ", self.isTrain)
@@ -100,8 +111,13 @@ class CycleGANModel(BaseModel):
         if self.isTrain:
             if opt.lambda_identity > 0.0:  # only works when input and output images have the same number of channels
                 assert(opt.input_nc == opt.output_nc)
-            self.fake_A_pool = ImagePool(opt.pool_size)  # create image buffer to store previously generated images
-            self.fake_B_pool = ImagePool(opt.pool_size)  # create image buffer to store previously generated images
+            if opt.pool_backend == 'list':
+                self.fake_A_pool = ImagePool(opt.pool_size)  # create image buffer to store previously generated images
+                self.fake_B_pool = ImagePool(opt.pool_size)  # create image buffer to store previously generated images
+            else:
+                assert opt.pool_backend in ('tensor', 'tensor_cpu'), 'unknown --pool_backend %s' % opt.pool_backend
+                self.fake_A_pool = TensorImagePool(opt.pool_size, cpu=opt.pool_backend == 'tensor_cpu')
+                self.fake_B_pool = TensorImagePool(opt.pool_size, cpu=opt.pool_backend == 'tensor_cpu')
             # define loss functions
             self.criterionGAN = networks.GANLoss(opt.gan_mode).to(self.device)  # define GAN loss.
             self.criterionCycle = torch.nn.L1Loss()
@@ -121,17 +137,36 @@ class CycleGANModel(BaseModel):
         The option 'direction' can be used to swap domain A and domain B.
         """
         AtoB = self.opt.direction == 'AtoB'
-        self.real_A = input['A' if AtoB else 'B'].to(self.device)
-        self.real_B = input['B' if AtoB else 'A'].to(self.device)
+        self.real_A = self.prepare_image(input['A' if AtoB else 'B'])
+        self.real_B = self.prepare_image(input['B' if AtoB else 'A'])
         self.image_paths = input['A_paths' if AtoB else 'B_paths']
 
     def forward(self, epoch):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
+        if self.opt.batched_generators:
+            self.forward_batched(epoch)
+            return
         self.fake_B = self.netG_A(self.real_A, epoch)  # G_A(A)
         self.rec_A = self.netG_B(self.fake_B, epoch)   # G_B(G_A(A))
         self.fake_A = self.netG_B(self.real_B, epoch)  # G_B(B)
         self.rec_B = self.netG_A(self.fake_A, epoch)   # G_A(G_B(B))
 
+    def forward_batched(self, epoch):
+        """Run the forward pass, and the identity pass when training, with one generator call per batch of independent inputs.
+
+        G_A(A) and G_A(B), then G_B(B), G_B(A) and G_B(G_A(A)) are each computed in one concatenated batch,
+        and G_A(G_B(B)) last: three generator calls instead of six.
+        """
+        identity = self.isTrain and self.opt.lambda_identity > 0 and torch.is_grad_enabled()
+        n_A, n_B = self.real_A.size(0), self.real_B.size(0)
+        if identity:
+            self.fake_B, self.idt_A = self.netG_A(torch.cat([self.real_A, self.real_B]), epoch).split([n_A, n_B])  # G_A(A), G_A(B)
+            self.fake_A, self.idt_B, self.rec_A = self.netG_B(torch.cat([self.real_B, self.real_A, self.fake_B]), epoch).split([n_B, n_A, n_A])
+        else:
+            self.fake_B = self.netG_A(self.real_A, epoch)  # G_A(A)
+            self.fake_A, self.rec_A = self.netG_B(torch.cat([self.real_B, self.fake_B]), epoch).split([n_B, n_A])
+        self.rec_B = self.netG_A(self.fake_A, epoch)   # G_A(G_B(B))
+
     def backward_D_basic(self, netD, real, fake):
         """Calculate GAN loss for the discriminator
 
@@ -143,15 +178,19 @@ class CycleGANModel(BaseModel):
         Return the discriminator loss.
         We also call loss_D.backward() to calculate the gradients.
         """
-        # Real
-        pred_real = netD(real)
-        loss_D_real = self.criterionGAN(pred_real, True)
-        # Fake
-        pred_fake = netD(fake.detach())
-        loss_D_fake = self.criterionGAN(pred_fake, False)
-        # Combined loss and calculate gradients
-        loss_D = (loss_D_real + loss_D_fake) * 0.5
-        loss_D.backward()
+        with self.autocast():
+            if self.opt.fused_D:  # real and fake in one batch
+                pred_real, pred_fake = netD(torch.cat([real, fake.detach()])).split([real.size(0), fake.size(0)])
+            else:
+                pred_real = netD(real)
+                pred_fake = netD(fake.detach())
+            # Real
+            loss_D_real = self.criterionGAN(pred_real, True)
+            # Fake
+            loss_D_fake = self.criterionGAN(pred_fake, False)
+            # Combined loss and calculate gradients
+            loss_D = (loss_D_real + loss_D_fake) * 0.5
+        self.amp_backward(loss_D)
         return loss_D
 
     def backward_D_A(self):
@@ -169,42 +208,46 @@ class CycleGANModel(BaseModel):
         lambda_idt = self.opt.lambda_identity
         lambda_A = self.opt.lambda_A
         lambda_B = self.opt.lambda_B
-        # Identity loss
-        if lambda_idt > 0:
-            # G_A should be identity if real_B is fed: ||G_A(B) - B||
-            self.idt_A = self.netG_A(self.real_B, epoch)
-            self.loss_idt_A = self.criterionIdt(self.idt_A, self.real_B) * lambda_B * lambda_idt
-            # G_B should be identity if real_A is fed: ||G_B(A) - A||
-            self.idt_B = self.netG_B(self.real_A, epoch)
-            self.loss_idt_B = self.criterionIdt(self.idt_B, self.real_A) * lambda_A * lambda_idt
-        else:
-            self.loss_idt_A = 0
-            self.loss_idt_B = 0
-
-        # GAN loss D_A(G_A(A))
-        self.loss_G_A = self.criterionGAN(self.netD_A(self.fake_B), True)
-        # GAN loss D_B(G_B(B))
-        self.loss_G_B = self.criterionGAN(self.netD_B(self.fake_A), True)
-        # Forward cycle loss || G_B(G_A(A)) - A||
-        self.loss_cycle_A = self.criterionCycle(self.rec_A, self.real_A) * lambda_A
-        # Backward cycle loss || G_A(G_B(B)) - B||
-        self.loss_cycle_B = self.criterionCycle(self.rec_B, self.real_B) * lambda_B
-        # combined loss and calculate gradients
-        self.loss_G = self.loss_G_A + self.loss_G_B + self.loss_cycle_A + self.loss_cycle_B + self.loss_idt_A + self.loss_idt_B
-        self.loss_G.backward()
+        with self.autocast():
+            # Identity loss
+            if lambda_idt > 0:
+                if not self.opt.batched_generators:  # otherwise computed in <forward_batched>
+                    self.idt_A = self.netG_A(self.real_B, epoch)
+                    self.idt_B = self.netG_B(self.real_A, epoch)
+                # G_A should be identity if real_B is fed: ||G_A(B) - B||
+                self.loss_idt_A = self.criterionIdt(self.idt_A, self.real_B) * lambda_B * lambda_idt
+                # G_B should be identity if real_A is fed: ||G_B(A) - A||
+                self.loss_idt_B = self.criterionIdt(self.idt_B, self.real_A) * lambda_A * lambda_idt
+            else:
+                self.loss_idt_A = 0
+                self.loss_idt_B = 0
+
+            # GAN loss D_A(G_A(A))
+            self.loss_G_A = self.criterionGAN(self.netD_A(self.fake_B), True)
+            # GAN loss D_B(G_B(B))
+            self.loss_G_B = self.criterionGAN(self.netD_B(self.fake_A), True)
+            # Forward cycle loss || G_B(G_A(A)) - A||
+            self.loss_cycle_A = self.criterionCycle(self.rec_A, self.real_A) * lambda_A
+            # Backward cycle loss || G_A(G_B(B)) - B||
+            self.loss_cycle_B = self.criterionCycle(self.rec_B, self.real_B) * lambda_B
+            # combined loss and calculate gradients
+            self.loss_G = self.loss_G_A + self.loss_G_B + self.loss_cycle_A + self.loss_cycle_B + self.loss_idt_A + self.loss_idt_B
+        self.amp_backward(self.loss_G)
 
     def optimize_parameters(self, epoch):
         """Calculate losses, gradients, and update network weights; called in every training iteration"""
         # forward
-        self.forward(epoch)      # compute fake images and reconstruction images.
+        with self.autocast():
+            self.forward(epoch)      # compute fake images and reconstruction images.
         # G_A and G_B
         self.set_requires_grad([self.netD_A, self.netD_B], False)  # Ds require no gradients when optimizing Gs
         self.optimizer_G.zero_grad()  # set G_A and G_B's gradients to zero
         self.backward_G(epoch)             # calculate gradients for G_A and G_B
-        self.optimizer_G.step()       # update G_A and G_B's weights
+        self.amp_step(self.optimizer_G)       # update G_A and G_B's weights
         # D_A and D_B
         self.set_requires_grad([self.netD_A, self.netD_B], True)
         self.optimizer_D.zero_grad()   # set D_A and D_B's gradients to zero
         self.backward_D_A()      # calculate gradients for D_A
         self.backward_D_B()      # calculate graidents for D_B
-        self.optimizer_D.step()  # update D_A and D_B's weights
+        self.amp_step(self.optimizer_D)  # update D_A and D_B's weights
+        self.amp_update()
@@ -4,7 +4,6 @@
 
 import torch
 import torch.nn.functional as F
-import random
 
 def DiffAugment(x, policy='', channels_first=True):
     if policy:
@@ -52,8 +51,10 @@ def rand_translation(x, ratio=0.2):
     return x
 
 
-def rand_cutout(x, ratio=0.5):
-    if random.random() < 0.3:
+def rand_cutout(x, ratio=0.5, p=0.3):
+    # cut out from each sample with probability p, so that the augmentation does not depend on the batch composition
+    apply = torch.rand(x.size(0), device=x.device) < p
+    if apply.any():
         cutout_size = int(x.size(2) * ratio + 0.5), int(x.size(3) * ratio + 0.5)
         offset_x = torch.randint(0, x.size(2) + (1 - cutout_size[0] % 2), size=[x.size(0), 1, 1], device=x.device)
         offset_y = torch.randint(0, x.size(3) + (1 - cutout_size[1] % 2), size=[x.size(0), 1, 1], device=x.device)
@@ -66,13 +67,22 @@ def rand_cutout(x, ratio=0.5):
         grid_y = torch.clamp(grid_y + offset_y - cutout_size[1] // 2, min=0, max=x.size(3) - 1)
         mask = torch.ones(x.size(0), x.size(2), x.size(3), dtype=x.dtype, device=x.device)
         mask[grid_batch, grid_x, grid_y] = 0
+        mask[~apply] = 1
         x = x * mask.unsqueeze(1)
     return x
 
 def rand_rotate(x, ratio=0.5):
-    k = random.randint(1,3)
-    if random.random() < ratio:
-        x = torch.rot90(x, k, [2,3])
+    # per sample: rotate by k * 90 degrees, k in [1, 3], with probability ratio; the draws stay on the host
+    assert x.size(2) == x.size(3), 'the rotate policy of DiffAugment rotates every sample on its own and needs square images, not %dx%d' % (x.size(2), x.size(3))
+    k = torch.randint(1, 4, size=[x.size(0)])
+    k[torch.rand(x.size(0)) >= ratio] = 0
+    if not k.any():
+        return x
+    x = x.clone()
+    for i in range(1, 4):  # rotate the samples of every k as one group
+        index = (k == i).nonzero().flatten().to(x.device)
+        if len(index):
+            x[index] = torch.rot90(x[index], i, [2, 3])
     return x
 
 AUGMENT_FNS = {
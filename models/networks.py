@@ -1,9 +1,12 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.nn import init
 import functools
+import math
 from torch.optim import lr_scheduler
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from torch.utils.checkpoint import checkpoint
 
 from models import TransGAN_im2im
 from models import ViT_8_8
@@ -120,19 +123,176 @@ def init_net(net, init_type='normal', init_gain=0.02, gpu_ids=[]):
     return net
 
 
-def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, init_type='normal', init_gain=0.02, gpu_ids=[]):
+def interpolate_pos_embed(pos_embed, num_tokens):
+    """Resize a [1, N, C] positional embedding of a square token grid to <num_tokens> tokens by bicubic interpolation.
+
+    A leading class token (when N - 1 tokens form the grid) is kept as it is.
+    """
+    num_extra = 0 if math.isqrt(pos_embed.size(1)) ** 2 == pos_embed.size(1) else 1
+    extra, grid = pos_embed[:, :num_extra], pos_embed[:, num_extra:]
+    size, new_size = math.isqrt(grid.size(1)), math.isqrt(num_tokens - num_extra)
+    assert size ** 2 == grid.size(1) and new_size ** 2 == num_tokens - num_extra, 'the positional embeddings are not square grids'
+    grid = grid.reshape(1, size, size, -1).permute(0, 3, 1, 2)
+    grid = F.interpolate(grid.float(), size=(new_size, new_size), mode='bicubic', align_corners=False).to(pos_embed.dtype)
+    return torch.cat([extra, grid.permute(0, 2, 3, 1).flatten(1, 2)], dim=1)
+
+
+def load_pretrained_weights(net, state_dict, allow_partial=False):
+    """Load a state dict into <net>, whether they were saved from / are wrapped in DataParallel or not.
+
+    Parameters:
+        net (network)        -- the network to load into; a DataParallel wrapper is unwrapped
+        state_dict (dict)    -- the weights; the 'module.' prefix of DataParallel checkpoints is removed
+        allow_partial (bool) -- if the weights whose shape differs are skipped (with a warning) instead of raising an error
+
+    Weights saved at another geometry are adapted: positional embeddings ('pos_embed*') are interpolated to the
+    new token grid. Any other weight whose shape differs raises a RuntimeError unless <allow_partial>.
+    Missing and unexpected keys are allowed (strict=False); returns the result of <load_state_dict>.
+    """
+    if isinstance(net, torch.nn.DataParallel):
+        net = net.module
+    state_dict = OrderedDict((k[len('module.'):] if k.startswith('module.') else k, v) for k, v in state_dict.items())
+    own_state = net.state_dict()
+    skipped = []
+    for k, v in list(state_dict.items()):
+        if k not in own_state or own_state[k].shape == v.shape:
+            continue
+        if 'pos_embed' in k and v.dim() == 3 and v.size(2) == own_state[k].size(2):
+            state_dict[k] = interpolate_pos_embed(v, own_state[k].size(1))
+            print('interpolated %s from %s to %s' % (k, tuple(v.shape), tuple(own_state[k].shape)))
+        else:
+            del state_dict[k]
+            skipped.append('%s: %s in the checkpoint, %s in the network' % (k, tuple(v.shape), tuple(own_state[k].shape)))
+    if skipped:
+        message = '%d of the %d checkpoint tensors do not match the shape of %s:\n    %s' % (
+            len(skipped), len(skipped) + len(state_dict), type(net).__name__, '\n    '.join(skipped))
+        if not allow_partial:
+            raise RuntimeError(message + '\ncheck --transgan_embed_dim, --transgan_d_dim and --patch_size, '
+                               'or pass --allow_partial_checkpoint to train these weights from scratch')
+        print('WARNING: ' + message + '\nWARNING: these weights are trained from scratch')
+    return net.load_state_dict(state_dict, strict=False)
+
+
+def get_checkpoint_blocks(net):
+    """Return the generator blocks that support activation checkpointing, from the input side to the output side.
+
+    These are the ResnetBlocks, the inner UnetSkipConnectionBlocks (outermost first) and the transgan Blocks.
+    """
+    if isinstance(net, torch.nn.DataParallel):
+        net = net.module
+    return [m for m in net.modules() if hasattr(m, 'use_checkpoint') and not getattr(m, 'outermost', False)]
+
+
+def set_grad_checkpointing(net, blocks):
+    """Recompute the activations of some generator blocks in the backward pass instead of keeping them.
+
+    Parameters:
+        net (network)         -- the generator
+        blocks (int or list)  -- the number of checkpointed blocks, evenly spaced (-1: all), or the blocks themselves
+
+    Every checkpointed block is a segment: only its input is kept, and it runs a second time in the backward pass.
+    """
+    all_blocks = get_checkpoint_blocks(net)
+    if isinstance(blocks, int):
+        n = len(all_blocks) if blocks < 0 else min(blocks, len(all_blocks))
+        blocks = [all_blocks[i * len(all_blocks) // n] for i in range(n)]
+    for block in all_blocks:
+        block.use_checkpoint = any(block is b for b in blocks)
+    print('activation checkpointing: %d of %d blocks' % (len(blocks), len(all_blocks)))
+
+
+def profile_activations(net, *inputs):
+    """Run a forward pass of <net> and return the bytes of the activations it keeps for the backward pass.
+
+    Returns the total and the bytes of every block of <get_checkpoint_blocks> (its own, without nested blocks).
+    The buffers of the network (e.g. running statistics) are restored afterwards.
+    """
+    blocks = get_checkpoint_blocks(net)
+    block_bytes = {block: 0 for block in blocks}
+    active, seen, total = [], set(), [0]
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        if not isinstance(tensor, nn.Parameter) and storage.data_ptr() not in seen:
+            seen.add(storage.data_ptr())
+            total[0] += storage.nbytes()
+            if active:
+                block_bytes[active[-1]] += storage.nbytes()
+        return tensor
+
+    def enter(block, args):
+        active.append(block)
+
+    def leave(block, args, output):
+        active.pop()
+
+    handles = []
+    for block in blocks:
+        handles.append(block.register_forward_pre_hook(enter))
+        handles.append(block.register_forward_hook(leave))
+    buffers = [(b, b.clone()) for b in net.buffers()]
+    use_checkpoint = [block.use_checkpoint for block in blocks]
+    for block in blocks:
+        block.use_checkpoint = False
+    try:
+        with torch.enable_grad(), torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            net(*inputs)
+    finally:
+        for handle in handles:
+            handle.remove()
+        for block, flag in zip(blocks, use_checkpoint):
+            block.use_checkpoint = flag
+        with torch.no_grad():
+            for b, value in buffers:
+                b.copy_(value)
+    return total[0], block_bytes
+
+
+def fit_grad_checkpointing(net, budget, *inputs):
+    """Checkpoint the fewest generator blocks that bring the activation memory of a forward pass under <budget> bytes.
+
+    Parameters:
+        net (network)   -- the generator
+        budget (int)    -- the target activation memory of one forward pass of <inputs>, in bytes
+        inputs          -- the inputs of a forward pass at the training shape
+
+    The largest blocks are checkpointed first. The memory of a configuration is estimated as the activations of
+    the blocks that are kept, plus the largest checkpointed block, which is recomputed in the backward pass.
+    """
+    total, block_bytes = profile_activations(net, *inputs)
+    blocks = sorted(block_bytes, key=block_bytes.get, reverse=True)
+    for n in range(len(blocks) + 1):
+        estimate = total - sum(block_bytes[b] for b in blocks[:n]) + (block_bytes[blocks[0]] if n > 0 else 0)
+        if estimate <= budget:
+            break
+    print('activations of one forward pass: %.1f MB without checkpointing, about %.1f MB with it (budget %.1f MB)'
+          % (total / 2 ** 20, estimate / 2 ** 20, budget / 2 ** 20))
+    if estimate > budget:
+        print('the activation memory budget cannot be reached; checkpointing all the blocks')
+    set_grad_checkpointing(net, blocks[:n])
+
+
+def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, init_type='normal', init_gain=0.02, gpu_ids=[], attn_backend='math',
+             local_attn=False, attn_chunk_sizes=(), upsample_attn='dense', img_size=64, patch_size=4, embed_dim=1024):
     """Create a generator
 
     Parameters:
         input_nc (int) -- the number of channels in input images
         output_nc (int) -- the number of channels in output images
-        ngf (int) -- the number of filters in the last conv layer
+        ngf (int) -- the number of filters in the last conv layer; not used by [transgan]
         netG (str) -- the architecture's name: resnet_9blocks | resnet_6blocks | unet_256 | unet_128
         norm (str) -- the name of normalization layers used in the network: batch | instance | none
         use_dropout (bool) -- if use dropout layers.
         init_type (str)    -- the name of our initialization method.
         init_gain (float)  -- scaling factor for normal, xavier and orthogonal.
         gpu_ids (int list) -- which GPUs the network runs on: e.g., 0,1,2
+        attn_backend (str) -- the attention implementation of [transgan]: math | sdpa
+        local_attn (bool)  -- if [transgan] computes only the in-band attention scores while the attention is masked
+        attn_chunk_sizes (int list) -- the query/key chunk size of every [transgan] stage; 0 or missing: dense attention
+        upsample_attn (str) -- the attention of the [transgan] upsample stages: dense | axial | linear
+        img_size (int)     -- the size of the input and output images of [transgan]; a multiple of 8
+        patch_size (int)   -- the patch size of the [transgan] patch embedding
+        embed_dim (int)    -- the embedding dimension of the first [transgan] stage; a multiple of 64
 
     Returns a generator
 
@@ -159,27 +319,39 @@ def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, in
     elif netG == 'unet_256':
         net = UnetGenerator(input_nc, output_nc, 8, ngf, norm_layer=norm_layer, use_dropout=use_dropout)
     elif netG == 'transgan':
-        GEN_ARGS = namedtuple("gen_args", ["bottom_width", "latent_dim", "gf_dim", "img_size", "patch_size"])
-        genargs = GEN_ARGS(8, 1024, 1024, 64, 4)
-        net = TransGAN_im2im.GeneratorCifar(genargs)
+        GEN_ARGS = namedtuple("gen_args", ["bottom_width", "latent_dim", "gf_dim", "img_size", "patch_size", "attn_backend", "local_attn",
+                                           "attn_chunk_sizes", "upsample_attn"])
+        assert img_size % 8 == 0, '[transgan] upsamples its first token grid 8x; img_size must be a multiple of 8, not %d' % img_size
+        bottom_width = img_size // 8  # the token grid width of the first stage
+        assert embed_dim % 64 == 0 and img_size % patch_size == 0, '[transgan] needs embed_dim divisible by 64 and img_size divisible by patch_size'
+        genargs = GEN_ARGS(bottom_width, 1024, embed_dim, img_size, patch_size, attn_backend, local_attn, tuple(attn_chunk_sizes), upsample_attn)
+        net = TransGAN_im2im.GeneratorCifar(genargs, in_chans=input_nc, out_chans=output_nc)
     else:
         raise NotImplementedError('Generator model name [%s] is not recognized' % netG)
         
     return init_net(net, init_type, init_gain, gpu_ids)
 
 
-def define_D(input_nc, ndf, netD, n_layers_D=3, norm='batch', init_type='normal', init_gain=0.02, gpu_ids=[]):
+def define_D(input_nc, ndf, netD, n_layers_D=3, norm='batch', init_type='normal', init_gain=0.02, gpu_ids=[], attn_backend='math',
+             img_size=64, patch_size=4, d_depth=7, diff_aug='translation,cutout,color', token_merge=0., embed_dim=384):
     """Create a discriminator
 
     Parameters:
         input_nc (int)     -- the number of channels in input images
-        ndf (int)          -- the number of filters in the first conv layer
+        ndf (int)          -- the number of filters in the first conv layer; not used by [transgan]
         netD (str)         -- the architecture's name: basic | n_layers | pixel
         n_layers_D (int)   -- the number of conv layers in the discriminator; effective when netD=='n_layers'
         norm (str)         -- the type of normalization layers used in the network.
         init_type (str)    -- the name of the initialization method.
         init_gain (float)  -- scaling factor for normal, xavier and orthogonal.
         gpu_ids (int list) -- which GPUs the network runs on: e.g., 0,1,2
+        attn_backend (str) -- the attention implementation of [transgan]: math | sdpa
+        img_size (int)     -- the size of the input images of [transgan]
+        patch_size (int)   -- the patch size of the [transgan] patch embedding
+        d_depth (int)      -- the number of [transgan] transformer blocks
+        diff_aug (str)     -- the DiffAugment policy of [transgan], e.g. translation,cutout,color
+        token_merge (float) -- the fraction of patch tokens every [transgan] block merges; 0 disables token merging
+        embed_dim (int)    -- the embedding dimension of [transgan]
 
     Returns a discriminator
 
@@ -208,9 +380,11 @@ def define_D(input_nc, ndf, netD, n_layers_D=3, norm='batch', init_type='normal'
     elif netD == 'pixel':     # classify if each pixel is real or fake
         net = PixelDiscriminator(input_nc, ndf, norm_layer=norm_layer)
     elif netD == 'transgan':
-        DIS_ARGS = namedtuple("gen_args", ["df_dim", "d_depth", "diff_aug", "img_size", "patch_size"])
-        disargs = DIS_ARGS(384, 7, "translation,cutout,color", 64, 4)
-        net = ViT_8_8.Discriminator(disargs)
+        DIS_ARGS = namedtuple("gen_args", ["df_dim", "d_depth", "diff_aug", "img_size", "patch_size", "attn_backend",
+                                           "token_merge"])
+        assert img_size % patch_size == 0, '[transgan] needs img_size divisible by patch_size'
+        disargs = DIS_ARGS(embed_dim, d_depth, diff_aug, img_size, patch_size, attn_backend, token_merge)
+        net = ViT_8_8.Discriminator(disargs, in_chans=input_nc)
     else:
         raise NotImplementedError('Discriminator model name [%s] is not recognized' % netD)
     return init_net(net, init_type, init_gain, gpu_ids)
@@ -277,6 +451,7 @@ class GANLoss(nn.Module):
         Returns:
             the calculated loss.
         """
+        prediction = prediction.float()  # the loss is computed in fp32, also under autocast
         if self.gan_mode in ['lsgan', 'vanilla']:
             target_tensor = self.get_target_tensor(prediction, target_is_real)
             loss = self.loss(prediction, target_tensor)
@@ -313,8 +488,9 @@ def cal_gradient_penalty(netD, real_data, fake_data, device, type='mixed', const
             interpolatesv = alpha * real_data + ((1 - alpha) * fake_data)
         else:
             raise NotImplementedError('{} not implemented'.format(type))
-        interpolatesv.requires_grad_(True)
-        disc_interpolates = netD(interpolatesv)
+        interpolatesv = interpolatesv.float().requires_grad_(True)
+        with torch.autocast(torch.device(device).type, enabled=False):  # the penalty on the gradient norm needs fp32 gradients
+            disc_interpolates = netD(interpolatesv)
         gradients = torch.autograd.grad(outputs=disc_interpolates, inputs=interpolatesv,
                                         grad_outputs=torch.ones(disc_interpolates.size()).to(device),
                                         create_graph=True, retain_graph=True, only_inputs=True)
@@ -399,6 +575,7 @@ class ResnetBlock(nn.Module):
         """
         super(ResnetBlock, self).__init__()
         self.conv_block = self.build_conv_block(dim, padding_type, norm_layer, use_dropout, use_bias)
+        self.use_checkpoint = False  # recompute the activations in the backward pass; see <set_grad_checkpointing>
 
     def build_conv_block(self, dim, padding_type, norm_layer, use_dropout, use_bias):
         """Construct a convolutional block.
@@ -442,6 +619,8 @@ class ResnetBlock(nn.Module):
 
     def forward(self, x):
         """Forward function (with skip connections)"""
+        if self.use_checkpoint and torch.is_grad_enabled():
+            return x + checkpoint(self.conv_block, x, use_reentrant=False)
         out = x + self.conv_block(x)  # add skip connections
         return out
 
@@ -500,6 +679,7 @@ class UnetSkipConnectionBlock(nn.Module):
         """
         super(UnetSkipConnectionBlock, self).__init__()
         self.outermost = outermost
+        self.use_checkpoint = False  # recompute the activations in the backward pass; see <set_grad_checkpointing>
         if type(norm_layer) == functools.partial:
             use_bias = norm_layer.func == nn.InstanceNorm2d
         else:
@@ -544,9 +724,16 @@ class UnetSkipConnectionBlock(nn.Module):
     def forward(self, x):
         if self.outermost:
             return self.model(x)
+        elif self.use_checkpoint and torch.is_grad_enabled():
+            return checkpoint(self.forward_skip, x, use_reentrant=False)
         else:   # add skip connections
             return torch.cat([x, self.model(x)], 1)
 
+    def forward_skip(self, x):
+        """The skip connection on a copy of x: the in-place LeakyReLU would otherwise change the input kept for the recomputation."""
+        x = x.clone()
+        return torch.cat([x, self.model(x)], 1)
+
 
 class NLayerDiscriminator(nn.Module):
     """Defines a PatchGAN discriminator"""
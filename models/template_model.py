@@ -57,7 +57,10 @@ class TemplateModel(BaseModel):
         # you can use opt.isTrain to specify different behaviors for training and test. For example, some networks will not be used during test, and you don't need to load them.
         self.model_names = ['G']
         # define networks; you can use opt.isTrain to specify different behaviors for training and test.
-        self.netG = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.netG, gpu_ids=self.gpu_ids)
+        self.netG = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.netG, gpu_ids=self.gpu_ids, attn_backend=opt.attn_backend,
+                                      local_attn=opt.local_attn, attn_chunk_sizes=opt.attn_chunk_sizes,
+                                      upsample_attn=opt.upsample_attn, img_size=opt.crop_size, patch_size=opt.patch_size,
+                                      embed_dim=opt.transgan_embed_dim)
         if self.isTrain:  # only defined during training time
             # define your loss functions. You can use losses provided by torch.nn such as torch.nn.L1Loss.
             # We also provide a GANLoss class "networks.GANLoss". self.criterionGAN = networks.GANLoss().to(self.device)
@@ -76,8 +79,8 @@ class TemplateModel(BaseModel):
             input: a dictionary that contains the data itself and its metadata information.
         """
         AtoB = self.opt.direction == 'AtoB'  # use <direction> to swap data_A and data_B
-        self.data_A = input['A' if AtoB else 'B'].to(self.device)  # get image data A
-        self.data_B = input['B' if AtoB else 'A'].to(self.device)  # get image data B
+        self.data_A = self.prepare_image(input['A' if AtoB else 'B'])  # get image data A
+        self.data_B = self.prepare_image(input['B' if AtoB else 'A'])  # get image data B
         self.image_paths = input['A_paths' if AtoB else 'B_paths']  # get image paths
 
     def forward(self):
@@ -88,12 +91,15 @@ class TemplateModel(BaseModel):
         """Calculate losses, gradients, and update network weights; called in every training iteration"""
         # caculate the intermediate results if necessary; here self.output has been computed during function <forward>
         # calculate loss given the input and intermediate results
-        self.loss_G = self.criterionLoss(self.output, self.data_B) * self.opt.lambda_regression
-        self.loss_G.backward()       # calculate gradients of network G w.r.t. loss_G
+        with self.autocast():
+            self.loss_G = self.criterionLoss(self.output, self.data_B) * self.opt.lambda_regression
+        self.amp_backward(self.loss_G)  # calculate gradients of network G w.r.t. loss_G; scaled with '--amp fp16'
 
     def optimize_parameters(self):
         """Update network weights; it will be called in every training iteration."""
-        self.forward()               # first call forward to calculate intermediate results
+        with self.autocast():
+            self.forward()           # first call forward to calculate intermediate results
         self.optimizer.zero_grad()   # clear network G's existing gradients
         self.backward()              # calculate gradients for network G
-        self.optimizer.step()        # update gradients for network G
+        self.amp_step(self.optimizer)  # update gradients for network G
+        self.amp_update()
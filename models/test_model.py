@@ -43,7 +43,10 @@ class TestModel(BaseModel):
         # specify the models you want to save to the disk. The training/test scripts will call <BaseModel.save_networks> and <BaseModel.load_networks>
         self.model_names = ['G' + opt.model_suffix]  # only generator is needed.
         self.netG = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.netG,
-                                      opt.norm, not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids)
+                                      opt.norm, not opt.no_dropout, opt.init_type, opt.init_gain, self.gpu_ids, attn_backend=opt.attn_backend,
+                                      local_attn=opt.local_attn, attn_chunk_sizes=opt.attn_chunk_sizes,
+                                      upsample_attn=opt.upsample_attn, img_size=opt.crop_size, patch_size=opt.patch_size,
+                                      embed_dim=opt.transgan_embed_dim)
 
         # assigns the model to self.netG_[suffix] so that it can be loaded
         # please see <BaseModel.load_networks>
@@ -57,7 +60,7 @@ class TestModel(BaseModel):
 
         We need to use 'single_dataset' dataset mode. It only load images from one domain.
         """
-        self.real = input['A'].to(self.device)
+        self.real = self.prepare_image(input['A'])
         self.image_paths = input['A_paths']
 
     def forward(self):
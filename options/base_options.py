@@ -23,6 +23,8 @@ class BaseOptions():
         parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders trainA, trainB, valA, valB, etc)')
         parser.add_argument('--name', type=str, default='experiment_name', help='name of the experiment. It decides where to store samples and models')
         parser.add_argument('--gpu_ids', type=str, default='0', help='gpu ids: e.g. 0  0,1,2, 0,2. use -1 for CPU')
+        parser.add_argument('--cpu_threads', type=int, default=0, help='number of threads for intra-op parallelism on CPU (torch.set_num_threads); 0 keeps the torch default')
+        parser.add_argument('--cpu_interop_threads', type=int, default=0, help='number of threads for inter-op parallelism on CPU (torch.set_num_interop_threads); 0 keeps the torch default')
         parser.add_argument('--checkpoints_dir', type=str, default='./checkpoints', help='models are saved here')
         # model parameters
         parser.add_argument('--model', type=str, default='cycle_gan', help='chooses which model to use. [cycle_gan | pix2pix | test | colorization]')
@@ -32,13 +34,24 @@ class BaseOptions():
         parser.add_argument('--ndf', type=int, default=64, help='# of discrim filters in the first conv layer')
         parser.add_argument('--netD', type=str, default='transgan', help='specify discriminator architecture [basic | n_layers | pixel]. The basic model is a 70x70 PatchGAN. n_layers allows you to specify the layers in the discriminator')
         parser.add_argument('--netG', type=str, default='transgan', help='specify generator architecture [resnet_9blocks | resnet_6blocks | unet_256 | unet_128]')
+        parser.add_argument('--attn_backend', type=str, default='math', help='attention implementation of the transgan networks [math | sdpa]. math: explicit attention matrix; sdpa: fused torch.nn.functional.scaled_dot_product_attention (torch >= 2.1)')
+        parser.add_argument('--local_attn', action='store_true', help='if specified, the masked transgan attention of the early epochs only computes the in-band scores (linear in the number of tokens)')
+        parser.add_argument('--attn_chunk_sizes', type=str, default='', help='comma-separated query/key chunk sizes of the transgan generator stages (blocks, then each upsample stage), e.g. 0,0,256; chunked stages compute exact attention with memory linear in the number of tokens, also with --attn_backend sdpa. 0 or missing: dense attention')
+        parser.add_argument('--upsample_attn', type=str, default='dense', choices=['dense', 'axial', 'linear'], help='attention of the transgan generator upsample stages [dense | axial | linear]. axial: within rows and columns, O(N*sqrt(N)); linear: kernelized, O(N). Both ignore the band mask of the early epochs')
+        parser.add_argument('--transgan_embed_dim', type=int, default=1024, help='embedding dimension of the first stage of the transgan generator; a multiple of 64')
+        parser.add_argument('--transgan_d_dim', type=int, default=384, help='embedding dimension of the transgan discriminator')
+        parser.add_argument('--patch_size', type=int, default=4, help='patch size of the transgan patch embeddings; crop_size must be divisible by it')
+        parser.add_argument('--d_depth', type=int, default=7, help='number of transformer blocks of the transgan discriminator')
+        parser.add_argument('--diff_aug', type=str, default='translation,cutout,color', help='DiffAugment policy of the transgan discriminator; empty to disable')
+        parser.add_argument('--token_merge', type=float, default=0., help='fraction of the patch tokens merged by every block of the transgan discriminator (token merging); 0 keeps all the tokens')
+        parser.add_argument('--amp', type=str, default='none', help='mixed precision autocast of the forward passes and losses [none | fp16 | bf16]. bf16 is the fast one on CPU; fp16 also scales the losses')
         parser.add_argument('--n_layers_D', type=int, default=3, help='only used if netD==n_layers')
         parser.add_argument('--norm', type=str, default='instance', help='instance normalization or batch normalization [instance | batch | none]')
         parser.add_argument('--init_type', type=str, default='normal', help='network initialization [normal | xavier | kaiming | orthogonal]')
         parser.add_argument('--init_gain', type=float, default=0.02, help='scaling factor for normal, xavier and orthogonal.')
         parser.add_argument('--no_dropout', action='store_true', help='no dropout for the generator')
         # dataset parameters
-        parser.add_argument('--dataset_mode', type=str, default='unaligned', help='chooses how datasets are loaded. [unaligned | aligned | single | colorization]')
+        parser.add_argument('--dataset_mode', type=str, default='unaligned', help='chooses how datasets are loaded. [unaligned | aligned | single | colorization | packed | tar]')
         parser.add_argument('--direction', type=str, default='AtoB', help='AtoB or BtoA')
         parser.add_argument('--serial_batches', action='store_true', help='if true, takes images in order to make batches, otherwise takes them randomly')
         parser.add_argument('--num_threads', default=4, type=int, help='# threads for loading data')
@@ -48,6 +61,16 @@ class BaseOptions():
         parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='Maximum number of samples allowed per dataset. If the dataset directory contains more than max_dataset_size, only a subset is loaded.')
         parser.add_argument('--preprocess', type=str, default='resize_and_crop', help='scaling and cropping of images at load time [resize_and_crop | crop | scale_width | scale_width_and_crop | none]')
         parser.add_argument('--no_flip', action='store_true', help='if specified, do not flip the images for data augmentation')
+        parser.add_argument('--use_manifest', action='store_true', help='list image directories from a persisted manifest that is refreshed incrementally, instead of walking them on every start. Only added, removed and renamed files are noticed; files rewritten in place only with --verify_images')
+        parser.add_argument('--manifest_dir', type=str, default='', help='where to store the image manifests; $XDG_CACHE_HOME/image_manifests (~/.cache/image_manifests) by default')
+        parser.add_argument('--verify_images', action='store_true', help='decode every image once up front (in parallel) and skip corrupt ones; implies --use_manifest. Also re-stats every listed file, to notice images rewritten in place')
+        parser.add_argument('--resize_cache_dir', type=str, default='', help='if specified, cache images resized to load_size in this directory, so that later epochs only crop and flip')
+        parser.add_argument('--augment_backend', type=str, default='pil', help='where preprocessing runs. [pil | tensor]. pil: per image in the workers; tensor: workers return uint8 images and resize/crop/flip/normalize run batched after collation')
+        parser.add_argument('--decode_backend', type=str, default='pil', help='how images are decoded. [pil | fast]. fast: decode JPEGs at a reduced scale when they are resized anyway, and with torchvision.io.decode_jpeg otherwise; see data/image_decode.py')
+        parser.add_argument('--uint8_transfer', action='store_true', help='if specified, the data loader returns uint8 images and the model converts and normalizes them on its device')
+        parser.add_argument('--bucket_by_shape', action='store_true', help='if specified, only batch images with the same shape after preprocessing, so that scale_width and none work with batch_size > 1')
+        parser.add_argument('--pair_sampler', action='store_true', help='if specified, draw the (A, B) pairs of unaligned data per epoch in the main process; reproducible for any number of workers and sharded across distributed processes')
+        parser.add_argument('--sampler_seed', type=int, default=0, help='seed of --pair_sampler; epoch e uses seed + e')
         parser.add_argument('--display_winsize', type=int, default=256, help='display window size for both visdom and HTML')
         # additional parameters
         parser.add_argument('--epoch', type=str, default='latest', help='which epoch to load? set to latest to use latest cached model')
@@ -76,6 +99,13 @@ class BaseOptions():
         parser = model_option_setter(parser, self.isTrain)
         opt, _ = parser.parse_known_args()  # parse again with new defaults
 
+        # the image size of transgan defaults to the 64x64 geometry of the pretrained celeba checkpoint
+        if opt.netG == 'transgan':
+            parser.set_defaults(load_size=64, crop_size=64)
+            opt, _ = parser.parse_known_args()
+            if opt.load_size == 64 or opt.crop_size == 64:
+                print('netG transgan: --load_size and --crop_size default to 64 (not 286 and 256), the image size of the pretrained checkpoint')
+
         # modify dataset-related parser options
         dataset_name = opt.dataset_mode
         dataset_option_setter = data.get_option_setter(dataset_name)
@@ -132,5 +162,17 @@ class BaseOptions():
         if len(opt.gpu_ids) > 0:
             torch.cuda.set_device(opt.gpu_ids[0])
 
+        # set the attention chunk sizes
+        opt.attn_chunk_sizes = [int(size) for size in opt.attn_chunk_sizes.split(',') if size]
+
+        # set the cpu threads; the inter-op pool can only be sized before it is first used
+        if opt.cpu_threads > 0:
+            torch.set_num_threads(opt.cpu_threads)
+        if opt.cpu_interop_threads > 0:
+            try:
+                torch.set_num_interop_threads(opt.cpu_interop_threads)
+            except RuntimeError:
+                print('could not set --cpu_interop_threads: torch already started its inter-op thread pool')
+
         self.opt = opt
         return self.opt
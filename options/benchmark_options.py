@@ -0,0 +1,31 @@
+from .base_options import BaseOptions
+import data
+
+
+class BenchmarkOptions(BaseOptions):
+    """This class includes the options of the data loading benchmark (benchmark_data.py).
+
+    It also includes shared options defined in BaseOptions.
+    The --bench_* options take comma-separated lists; the benchmark runs every combination of their values.
+    """
+
+    def initialize(self, parser):
+        parser = BaseOptions.initialize(self, parser)  # define shared options
+        parser.add_argument('--phase', type=str, default='train', help='train, val, test, etc')
+        parser.add_argument('--bench_dataset_modes', type=str, default='', help='comma-separated dataset modes to compare, e.g. unaligned,packed; [dataset_mode] by default')
+        parser.add_argument('--bench_preprocess', type=str, default='', help='comma-separated preprocess modes to compare, e.g. resize_and_crop,crop; [preprocess] by default')
+        parser.add_argument('--bench_num_threads', type=str, default='', help='comma-separated numbers of loader workers to compare, e.g. 0,4,8; [num_threads] by default')
+        parser.add_argument('--bench_batch_sizes', type=str, default='', help='comma-separated batch sizes to compare, e.g. 1,4; [batch_size] by default')
+        parser.add_argument('--bench_batches', type=int, default=100, help='number of batches timed per setting, after the first one')
+        parser.add_argument('--bench_output', type=str, default='', help='where to write the results as JSON; [checkpoints_dir]/[name]/data_benchmark.json by default')
+        parser.set_defaults(name='data_benchmark')
+        self.isTrain = True
+        return parser
+
+    def gather_options(self):
+        """Also add the options of every dataset mode in --bench_dataset_modes."""
+        opt = BaseOptions.gather_options(self)
+        modes = [mode for mode in opt.bench_dataset_modes.split(',') if mode and mode != opt.dataset_mode]
+        for mode in dict.fromkeys(modes):
+            self.parser = data.get_option_setter(mode)(self.parser, self.isTrain)
+        return self.parser.parse_args()
@@ -32,12 +32,22 @@ class TrainOptions(BaseOptions):
         parser.add_argument('--beta1', type=float, default=0.5, help='momentum term of adam')
         parser.add_argument('--lr', type=float, default=0.0002, help='initial learning rate for adam')
         parser.add_argument('--gan_mode', type=str, default='lsgan', help='the type of GAN objective. [vanilla| lsgan | wgangp]. vanilla GAN loss is the cross-entropy objective used in the original GAN paper.')
+        parser.add_argument('--grad_ckpt_blocks', type=int, default=0, help='number of generator blocks (ResnetBlock, UnetSkipConnectionBlock or transgan Block) whose activations are recomputed in the backward pass instead of kept; -1: all')
+        parser.add_argument('--grad_ckpt_budget', type=float, default=0, help='if positive, checkpoint the fewest generator blocks that keep the activations of one generator forward pass under this many MB; overrides --grad_ckpt_blocks')
+        parser.add_argument('--fused_D', action='store_true', help='if specified, the discriminator loss evaluates the real and fake images in one concatenated batch instead of two; equivalent unless netD uses batch normalization')
         parser.add_argument('--pool_size', type=int, default=50, help='the size of image buffer that stores previously generated images')
+        parser.add_argument('--pool_backend', type=str, default='list', help='storage of the image buffer [list | tensor | tensor_cpu]. tensor: one preallocated buffer on the device of the images, replaced and gathered per batch; tensor_cpu: the same in pinned CPU memory, to save accelerator memory')
         parser.add_argument('--lr_policy', type=str, default='linear', help='learning rate policy. [linear | step | plateau | cosine]')
         parser.add_argument('--lr_decay_iters', type=int, default=50, help='multiply by a gamma every lr_decay_iters iterations')
-        parser.add_argument('--exp_name', type=str, default='CycleGAN')
+        parser.add_argument('--exp_name', type=str, default='CycleGAN', help='run name of the wandb metrics sink')
+        parser.add_argument('--metrics_sinks', type=str, default='jsonl', help='comma-separated backends of the training metrics [jsonl | csv | visdom | wandb], e.g. jsonl,wandb to also log to Weights & Biases (skipped if not installed). See util/metrics.py')
+        parser.add_argument('--metrics_dir', type=str, default='', help='where the jsonl and csv sinks write; [checkpoints_dir]/[name] by default')
+        parser.add_argument('--metrics_flush_interval', type=float, default=10, help='seconds between two writes of the queued metrics to the sinks; 0 writes them as they come')
+        parser.add_argument('--metrics_queue_size', type=int, default=1000, help='maximum number of queued metrics records; further records are dropped instead of blocking training')
+        parser.add_argument('--metrics_close_timeout', type=float, default=30, help='seconds to wait for the metrics sinks to write the remaining records at the end of training')
         parser.add_argument('--val_metric_freq', type=int, default=1, help='frequency of FID calculating (epoch)')
         parser.add_argument('--checkpoint', type=str, default='./pretrained_weight/celeba64_checkpoint.pth')
+        parser.add_argument('--allow_partial_checkpoint', action='store_true', help='if specified, the weights of --checkpoint whose shape does not match the networks are skipped (trained from scratch) instead of raising an error')
         
         self.isTrain = True
         return parser
@@ -24,7 +24,7 @@ from options.test_options import TestOptions
 from data import create_dataset
 from models import create_model
 from util.visualizer import Visualizer, save_images
-import wandb
+from util.metrics import MetricsLogger
 from copy import deepcopy
 from util import html
 import os
@@ -38,7 +38,7 @@ import os
 if __name__ == '__main__':
     opt = TrainOptions().parse()   # get training options
     val_opts = deepcopy(opt)
-    experiment = wandb.init(name=opt.exp_name, project='CycleTransGAN')
+    metrics = MetricsLogger(opt)   # write the metrics to the --metrics_sinks in the background
     dataset = create_dataset(opt)  # create a dataset given opt.dataset_mode and other options
     dataset_size = len(dataset)    # get the number of images in the dataset.
     print('The number of training images = %d' % dataset_size)
@@ -51,7 +51,6 @@ if __name__ == '__main__':
     val_opts.no_flip = True  # no flip; comment this line if results on flipped images are needed.
     val_opts.display_id = -1
 
-    dataset = create_dataset(opt)  # create a dataset given opt.dataset_mode and other options
     val_dataset = create_dataset(val_opts)
     web_dir = os.path.join('fid_dir', val_opts.name,
                            '{}_{}'.format(val_opts.phase, val_opts.epoch))  # define the website directory
@@ -72,6 +71,7 @@ if __name__ == '__main__':
         epoch_iter = 0                  # the number of training iterations in current epoch, reset to 0 every epoch
         visualizer.reset()              # reset the visualizer: make sure it saves the results to HTML at least once every epoch
         model.update_learning_rate()    # update learning rates in the beginning of every epoch.
+        dataset.set_epoch(epoch)        # the (A, B) pairs of --pair_sampler only depend on the seed and the epoch
         for i, data in enumerate(dataset):  # inner loop within one epoch
             iter_start_time = time.time()  # timer for computation per iteration
             if total_iters % opt.print_freq == 0:
@@ -82,8 +82,7 @@ if __name__ == '__main__':
             model.set_input(data)         # unpack data from dataset and apply preprocessing
             model.optimize_parameters(epoch)   # calculate loss functions, get gradients, update network weights
 
-            losses = model.get_current_losses()
-            wandb.log(losses)
+            model.accumulate_losses()     # running loss statistics on the device; read at print_freq
 
             if total_iters % opt.display_freq == 0:   # display images on visdom and save images to a HTML file
                 save_result = total_iters % opt.update_html_freq == 0
@@ -92,7 +91,9 @@ if __name__ == '__main__':
 
             if total_iters % opt.print_freq == 0:    # print training losses and save logging information to the disk
                 t_comp = (time.time() - iter_start_time) / opt.batch_size
-                visualizer.print_current_losses(epoch, epoch_iter, losses, t_comp, t_data)
+                losses, variances = model.get_accumulated_losses()   # mean and variance since the last print
+                metrics.log({**losses, **{k + '_var': v for k, v in variances.items()}}, total_iters)
+                visualizer.print_current_losses(epoch, epoch_iter, losses, t_comp, t_data, variances)
                 if opt.display_id > 0:
                     visualizer.plot_current_losses(epoch, float(epoch_iter) / dataset_size, losses)
 
@@ -130,12 +131,12 @@ if __name__ == '__main__':
                             width=val_opts.display_winsize)
             fid_value = calculate_fid_given_paths(
                 paths=('./fid_dir/{d}/test_latest/images/'.format(d=opt.name), '{d}/test'.format(d=opt.dataroot) + test_letter),
-                batch_size=64, device='cuda', dims=2048)
-            wandb.log({'FID': fid_value})
+                batch_size=64, device=model.device, dims=2048)
+            metrics.log({'FID': fid_value}, total_iters)
             rand_examples = np.random.permutation(range(len(converted)))
             converted = torch.cat(converted, 0)[rand_examples][:9]
             all_rand = make_grid(converted, nrow=3)
-            wandb.log({"examples": [wandb.Image(all_rand, caption=f"Epoch {epoch}")]})
+            metrics.log_image('examples', all_rand, total_iters, caption=f"Epoch {epoch}")
 
             model.train()
 
@@ -143,4 +144,4 @@ if __name__ == '__main__':
             epoch, opt.n_epochs + opt.n_epochs_decay, time.time() - epoch_start_time))
 
         print('End of epoch %d / %d \t Time Taken: %d sec' % (epoch, opt.n_epochs + opt.n_epochs_decay, time.time() - epoch_start_time))
-    experiment.finish()
\ No newline at end of file
+    metrics.close()
\ No newline at end of file
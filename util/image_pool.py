@@ -52,3 +52,69 @@ class ImagePool():
                     return_images.append(image)
         return_images = torch.cat(return_images, 0)   # collect all the images and return
         return return_images
+
+
+class TensorImagePool():
+    """This class implements the image buffer of <ImagePool> as one preallocated tensor.
+
+    The random draws are the same as in <ImagePool>, one by one on the host, so that both pools return the same images
+    for the same random state; the images are then gathered and stored for the whole batch at once.
+    The buffer is allocated at the first query, on the device of the images or in (pinned) CPU memory.
+    """
+
+    def __init__(self, pool_size, cpu=False):
+        """Initialize the TensorImagePool class
+
+        Parameters:
+            pool_size (int) -- the size of image buffer, if pool_size=0, no buffer will be created
+            cpu (bool)      -- if the buffer is kept in CPU memory (pinned when CUDA is available) instead of on the device of the images
+        """
+        self.pool_size = pool_size
+        self.cpu = cpu
+        self.num_imgs = 0
+        self.images = None
+
+    def query(self, images):
+        """Return images from the pool; see <ImagePool.query>.
+
+        Parameters:
+            images: the latest generated images from the generator
+        """
+        if self.pool_size == 0:  # if the buffer size is 0, do nothing
+            return images
+        images = images.detach()
+        if self.images is None:
+            device = torch.device('cpu') if self.cpu else images.device
+            pin_memory = self.cpu and torch.cuda.is_available()
+            self.images = torch.empty((self.pool_size,) + images.shape[1:], dtype=images.dtype, device=device, pin_memory=pin_memory)
+        assert self.images.shape[1:] == images.shape[1:], 'the image pool needs images of shape %s' % str(tuple(self.images.shape[1:]))
+
+        # draw the sources of the returned images: index i < n is images[i], index n + k is slot k of the buffer.
+        # An image that replaces a slot written earlier in the same batch returns the image written there.
+        n = images.size(0)
+        sources, writes = [], {}  # writes: slot -> index of the image stored there by this batch
+        for i in range(n):
+            if self.num_imgs < self.pool_size:   # if the buffer is not full; keep inserting current images to the buffer
+                writes[self.num_imgs] = i
+                self.num_imgs = self.num_imgs + 1
+                sources.append(i)
+            elif random.uniform(0, 1) > 0.5:  # by 50% chance, return a previously stored image, and insert the current image
+                random_id = random.randint(0, self.pool_size - 1)  # randint is inclusive
+                sources.append(writes.get(random_id, n + random_id))
+                writes[random_id] = i
+            else:       # by another 50% chance, the buffer will return the current image
+                sources.append(i)
+
+        # gather the returned images, reading the buffer before writing to it
+        return_images = images
+        if sources != list(range(n)):
+            return_images = images.index_select(0, torch.tensor([s if s < n else i for i, s in enumerate(sources)], device=images.device))
+            pool_ids = [i for i, s in enumerate(sources) if s >= n]
+            if pool_ids:
+                stored = self.images.index_select(0, torch.tensor([sources[i] - n for i in pool_ids], device=self.images.device))
+                return_images.index_copy_(0, torch.tensor(pool_ids, device=images.device), stored.to(images.device, non_blocking=True))
+        if writes:
+            slots = list(writes)
+            stored = images.index_select(0, torch.tensor([writes[k] for k in slots], device=images.device))
+            self.images.index_copy_(0, torch.tensor(slots, device=self.images.device), stored.to(self.images.device))
+        return return_images
@@ -0,0 +1,206 @@
+"""Buffered metrics logging for training, with pluggable backends ('sinks').
+
+<MetricsLogger> only puts the metrics on a bounded queue; a background thread collects them and writes them to
+every sink in batches, every --metrics_flush_interval seconds. If the queue is full, records are dropped (and counted)
+instead of blocking the training loop. The sinks are created in the background thread too, so that a slow or
+unreachable service never stalls training. Available sinks (--metrics_sinks):
+    jsonl  -- one JSON object per record in [metrics_dir]/metrics.jsonl; images are saved as PNG files next to it
+    csv    -- (step, time, name, value) rows in [metrics_dir]/metrics.csv
+    visdom -- one line plot per metric (and the images) on the visdom server of --display_server/--display_port
+    wandb  -- Weights & Biases, opt-in; skipped if the package is not installed
+"""
+import os
+import csv
+import json
+import time
+import queue
+import threading
+from . import util
+
+
+class JsonlSink():
+    """Append the records to a JSON lines file."""
+
+    def __init__(self, opt, log_dir):
+        self.log_dir = log_dir
+        self.file = open(os.path.join(log_dir, 'metrics.jsonl'), 'a')
+
+    def write(self, records):
+        for record in records:
+            if 'images' in record:  # save the images, log their paths
+                paths = {}
+                for name, (image, caption) in record['images'].items():
+                    paths[name] = os.path.join('images', '%s_step%d.png' % (name, record['step']))
+                    util.mkdir(os.path.join(self.log_dir, 'images'))
+                    util.save_image(image, os.path.join(self.log_dir, paths[name]))
+                record = {'step': record['step'], 'time': record['time'], 'images': paths}
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvSink():
+    """Append the scalar metrics to a CSV file, one (step, time, name, value) row per metric."""
+
+    def __init__(self, opt, log_dir):
+        path = os.path.join(log_dir, 'metrics.csv')
+        new_file = not os.path.exists(path)
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(['step', 'time', 'name', 'value'])
+
+    def write(self, records):
+        for record in records:
+            for name, value in record.get('metrics', {}).items():
+                self.writer.writerow([record['step'], '%.3f' % record['time'], name, value])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class VisdomSink():
+    """Plot every metric in its own visdom window, and show the images."""
+
+    def __init__(self, opt, log_dir):
+        import visdom
+        self.vis = visdom.Visdom(server=opt.display_server, port=opt.display_port, env=opt.display_env)
+        self.name = opt.name
+
+    def write(self, records):
+        series = {}  # name -> ([steps], [values]); one request per metric and batch
+        for record in records:
+            for name, value in record.get('metrics', {}).items():
+                series.setdefault(name, ([], []))
+                series[name][0].append(record['step'])
+                series[name][1].append(value)
+            for name, (image, caption) in record.get('images', {}).items():
+                self.vis.image(image.transpose([2, 0, 1]), win='metrics_' + name, opts=dict(title=self.name + ' ' + name, caption=caption))
+        for name, (steps, values) in series.items():
+            self.vis.line(X=steps, Y=values, win='metrics_' + name, update='append', opts=dict(title=self.name + ' ' + name, xlabel='iterations'))
+
+    def close(self):
+        pass
+
+
+class WandbSink():
+    """Log to Weights & Biases, in the project 'CycleTransGAN' under the name --exp_name."""
+
+    def __init__(self, opt, log_dir):
+        import wandb
+        self.wandb = wandb
+        self.run = wandb.init(name=opt.exp_name, project='CycleTransGAN')
+
+    def write(self, records):
+        for record in records:
+            data = dict(record.get('metrics', {}))
+            for name, (image, caption) in record.get('images', {}).items():
+                data[name] = [self.wandb.Image(image, caption=caption)]
+            self.wandb.log(data, step=record['step'])
+
+    def close(self):
+        self.run.finish()
+
+
+SINKS = {'jsonl': JsonlSink, 'csv': CsvSink, 'visdom': VisdomSink, 'wandb': WandbSink}
+
+
+class MetricsLogger():
+    """This class queues metrics and images, and writes them to the sinks of --metrics_sinks in a background thread."""
+
+    def __init__(self, opt):
+        """Start the background thread.
+
+        Parameters:
+            opt -- stores all the experiment flags; needs to be a subclass of TrainOptions
+        """
+        self.sink_names = [name for name in opt.metrics_sinks.split(',') if name]
+        for name in self.sink_names:
+            assert name in SINKS, 'unknown metrics sink %s; choose from %s' % (name, ', '.join(SINKS))
+        self.opt = opt
+        self.log_dir = opt.metrics_dir or os.path.join(opt.checkpoints_dir, opt.name)
+        util.mkdirs(self.log_dir)
+        self.flush_interval = opt.metrics_flush_interval
+        self.close_timeout = opt.metrics_close_timeout
+        self.queue = queue.Queue(maxsize=opt.metrics_queue_size)
+        self.queued, self.written, self.dropped = 0, 0, 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        """Queue a record without blocking; drop it if the queue is full."""
+        if not self.sink_names:
+            return
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def log(self, metrics, step):
+        """Log scalar metrics.
+
+        Parameters:
+            metrics (dict) -- (name, float) pairs
+            step (int)     -- the total number of training iterations
+        """
+        self.put({'step': step, 'time': time.time(), 'metrics': {k: float(v) for k, v in metrics.items()}})
+
+    def log_image(self, name, image, step, caption=''):
+        """Log an image.
+
+        Parameters:
+            name (str)        -- the name of the image
+            image (tensor)    -- a CxHxW image in [-1, 1], e.g. a grid of generated images
+            step (int)        -- the total number of training iterations
+            caption (str)     -- the caption of the image
+        """
+        self.put({'step': step, 'time': time.time(), 'images': {name: (util.tensor2im(image[None]), caption)}})
+
+    def run(self):
+        """Create the sinks, then write the queued records in batches until <close>."""
+        sinks = {}
+        for name in self.sink_names:
+            try:
+                sinks[name] = SINKS[name](self.opt, self.log_dir)
+            except Exception as e:  # e.g. wandb not installed or unreachable
+                print('metrics sink %s is disabled: %s: %s' % (name, type(e).__name__, e))
+        records, closed = [], False
+        next_flush = time.time() + self.flush_interval
+        while not closed:
+            try:
+                record = self.queue.get(timeout=max(next_flush - time.time(), 0.01) if self.flush_interval > 0 else None)
+                if record is None:
+                    closed = True
+                else:
+                    records.append(record)
+            except queue.Empty:
+                pass
+            if records and (closed or time.time() >= next_flush):
+                for name, sink in sinks.items():
+                    try:
+                        sink.write(records)
+                    except Exception as e:
+                        print('metrics sink %s failed to write %d records: %s: %s' % (name, len(records), type(e).__name__, e))
+                self.written += len(records)
+                records = []
+            if time.time() >= next_flush:
+                next_flush = time.time() + self.flush_interval
+        for sink in sinks.values():
+            sink.close()
+
+    def close(self):
+        """Write the remaining records and close the sinks, waiting at most opt.metrics_close_timeout seconds."""
+        deadline = time.time() + self.close_timeout
+        try:
+            self.queue.put(None, timeout=self.close_timeout)
+        except queue.Full:  # the sinks are stuck; the thread is a daemon and does not keep the process alive
+            pass
+        self.thread.join(max(deadline - time.time(), 0))
+        if self.thread.is_alive():
+            print('the metrics sinks did not finish within %g sec; %d records were not written' % (self.close_timeout, self.queued - self.written))
+        if self.dropped:
+            print('%d metrics records were dropped because the queue was full; increase --metrics_queue_size' % self.dropped)
@@ -202,7 +202,7 @@ class Visualizer():
             self.create_visdom_connections()
 
     # losses: same format as |losses| of plot_current_losses
-    def print_current_losses(self, epoch, iters, losses, t_comp, t_data):
+    def print_current_losses(self, epoch, iters, losses, t_comp, t_data, variances=None):
         """print current losses on console; also save the losses to the disk
 
         Parameters:
@@ -211,10 +211,13 @@ class Visualizer():
             losses (OrderedDict) -- training losses stored in the format of (name, float) pairs
             t_comp (float) -- computational time per data point (normalized by batch_size)
             t_data (float) -- data loading time per data point (normalized by batch_size)
+            variances (OrderedDict) -- if given, the variances of the losses over the logging window
         """
         message = '(epoch: %d, iters: %d, time: %.3f, data: %.3f) ' % (epoch, iters, t_comp, t_data)
         for k, v in losses.items():
             message += '%s: %.3f ' % (k, v)
+            if variances and k in variances:
+                message += '(var %.4f) ' % variances[k]
 
         print(message)  # print the message
         with open(self.log_name, "a") as log_file: